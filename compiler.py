@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
+import collections
 import dataclasses
 import io
 import itertools
 import json
 import os
+import re
 import typing
 
-from typing import Dict, Optional, Tuple
+from typing import Callable, Dict, FrozenSet, Optional, Tuple
 
 from scrapscript import (
     Access,
@@ -18,6 +20,7 @@ from scrapscript import (
     Hole,
     Int,
     List,
+    MatchCase,
     MatchFunction,
     Object,
     Record,
@@ -27,28 +30,110 @@ from scrapscript import (
     Variant,
     Where,
     free_in,
+    row_flatten,
     type_of,
     IntType,
     StringType,
+    TyRow,
     parse,  # needed for /compilerepl
     tokenize,  # needed for /compilerepl
 )
 
-Env = Dict[str, str]
+# Bindings from scrapscript names to C expressions. Each binding pushes a new
+# child map instead of copying the whole environment.
+Env = typing.ChainMap[str, str]
+
+# Mirrors kSmallIntMinValue/kSmallIntMaxValue in the generated C
+SMALL_INT_BITS = 63
+SMALL_INT_MIN = -(1 << (SMALL_INT_BITS - 1))
+SMALL_INT_MAX = (1 << (SMALL_INT_BITS - 1)) - 1
+
+# Fixed fragments of generated C, encoded once
+HANDLES_LINE = b"HANDLES();\n"
+GC_PROTECT_PREFIX = b"GC_PROTECT("
+GC_PROTECT_SUFFIX = b");\n"
+
+# Lines that may allocate, and therefore may move heap objects. This must
+# cover every function in runtime.c that can allocate, directly or through a
+# callee: a missing one lets remove_unneeded_handles drop a handle that the GC
+# still needs. Every runtime allocator takes the heap as its first argument;
+# the rest allocate indirectly. Matching too much only keeps more handles alive.
+SAFEPOINT_RE = re.compile(
+    rb"\(heap\b|\b(?:closure_call|list_cons|string_concat|num_add|num_sub|num_mul|Record_builder_\w+)\("
+)
+OBJECT_HANDLE_RE = re.compile(rb"OBJECT_HANDLE\((\w+), (.*)\);")
+IDENTIFIER_RE = re.compile(rb"\w+")
+
+# Templates for the most frequently emitted statements
+OBJECT_HANDLE = "OBJECT_HANDLE(%s, %s);"
+RECORD_SET = "record_set(%s, /*index=*/%d, (struct record_field){.key=%s, .value=%s});"
+CLOSURE_GET = "closure_get(this, /*%s=*/%d)"
+CLOSURE_SET = "closure_set(%s, /*%s=*/%d, %s);"
+GOTO_IF_EMPTY_LIST = "if (is_empty_list(%s)) { goto %s; }"
+GOTO_IF_NOT_EMPTY_LIST = "if (!is_empty_list(%s)) { goto %s; }"
+GOTO_IF_NULL = "if (%s == NULL) { goto %s; }"
+LIST_FIRST = "list_first(%s)"
+LIST_REST = "list_rest(%s)"
+LIST_CONS = "list_cons(%s, %s)"
+RECORD_GET = "record_get(%s, %s)"
+
+# tmp_0, tmp_1, ... shared by every Compiler so that each name is only ever
+# formatted once per process
+TMP_NAMES: typing.List[str] = []
 
 
 @dataclasses.dataclass
 class CompiledFunction:
     name: str
     params: typing.List[str]
-    fields: typing.List[str] = dataclasses.field(default_factory=list)
-    code: typing.List[str] = dataclasses.field(default_factory=list)
+    fields: Tuple[str, ...] = ()
+    # UTF-8 encoded body of the function, one statement per line
+    buf: bytearray = dataclasses.field(default_factory=bytearray)
+    # C name of each value read out of `this`, mapped to its index there
+    closure_slots: Dict[str, int] = dataclasses.field(default_factory=dict)
 
     def __post_init__(self) -> None:
-        self.code.append("HANDLES();")
+        # The parameters are raw pointers and must be updated on GC. Build the
+        # whole prologue first so the buffer starts out at its size.
+        prologue = [HANDLES_LINE]
         for param in self.params:
-            # The parameters are raw pointers and must be updated on GC
-            self.code.append(f"GC_PROTECT({param});")
+            prologue += (GC_PROTECT_PREFIX, param.encode(), GC_PROTECT_SUFFIX)
+        self.buf = bytearray(b"".join(prologue))
+
+    def emit(self, line: str) -> None:
+        self.buf += line.encode()
+        self.buf += b"\n"
+
+    def remove_unneeded_handles(self) -> None:
+        """Drop GC handles for values that are never live across a safepoint.
+
+        Control flow in a compiled function only ever jumps forward, so if no
+        safepoint appears textually between a value's definition and its last
+        use, no path through the function can move it while it is live.
+        Callees protect their own arguments."""
+        lines = bytes(self.buf).split(b"\n")
+        # safepoints[i] is the number of safepoint lines before line i
+        safepoints = [0]
+        last_use: Dict[bytes, int] = {}
+        for i, line in enumerate(lines):
+            safepoints.append(safepoints[-1] + (SAFEPOINT_RE.search(line) is not None))
+            for word in IDENTIFIER_RE.findall(line):
+                last_use[word] = i
+        for i, line in enumerate(lines):
+            match = OBJECT_HANDLE_RE.fullmatch(line)
+            if match is None:
+                continue
+            name, exp = match.groups()
+            use = last_use[name]
+            if use > i and safepoints[use] == safepoints[i + 1]:
+                lines[i] = b"struct object* " + name + b" = " + exp + b";"
+        # Parameters are protected by the GC_PROTECT prologue on lines
+        # 1..len(params). Go backwards so deleting lines keeps indices valid.
+        for i, param in reversed(list(enumerate(self.params, start=1))):
+            use = last_use.get(param.encode(), i)
+            if use == i or safepoints[use] == safepoints[i + 1]:
+                del lines[i]
+        self.buf = bytearray(b"\n".join(lines))
 
     def decl(self) -> str:
         args = ", ".join(f"struct object* {arg}" for arg in self.params)
@@ -56,15 +141,59 @@ class CompiledFunction:
 
 
 class Compiler:
-    def __init__(self, main_fn: CompiledFunction) -> None:
-        self.gensym_counter: int = 0
+    # Fixed attribute layout: cheaper attribute access on the hot recursive
+    # paths and no per-instance __dict__
+    __slots__ = (
+        "tmp_counter",
+        "gensym_counters",
+        "functions",
+        "function",
+        "record_keys",
+        "record_builders",
+        "variant_tags",
+        "debug",
+        "_debug_prelude",
+        "const_heap",
+        "_const_objs",
+        "_free_cache",
+        "_record_keys_cache",
+        "_fold_cache",
+        "_small_strings",
+        "_c_strings",
+        "_functions_by_key",
+        "_sorted_names_cache",
+    )
+
+    def __init__(self, main_fn: CompiledFunction, debug: bool = False) -> None:
+        # Names are numbered per stem; different stems can never produce the
+        # same name
+        self.tmp_counter: int = 0
+        self.gensym_counters: Dict[str, int] = {}
         self.functions: typing.List[CompiledFunction] = [main_fn]
         self.function: CompiledFunction = main_fn
         self.record_keys: Dict[str, int] = {}
         self.record_builders: Dict[Tuple[str, ...], CompiledFunction] = {}
         self.variant_tags: Dict[str, int] = {}
-        self.debug: bool = False
+        self.debug: bool = debug
+        # Collect on every allocation in debug builds to shake out missing handles
+        self._debug_prelude: bytes = b"#ifndef NDEBUG\ncollect(heap);\n#endif\n" if debug else b""
         self.const_heap: typing.List[str] = []
+        # (type, tag, contents) -> pointer to an existing const heap object
+        self._const_objs: Dict[Tuple[str, str, str], str] = {}
+        # id(node) -> (node, free variables). Holding on to the node keeps its
+        # id from being reused for a different node during compilation.
+        self._free_cache: Dict[int, Tuple[Object, FrozenSet[str]]] = {}
+        # id(node) -> (node, sorted keys) for Record nodes
+        self._record_keys_cache: Dict[int, Tuple[Record, Tuple[str, ...]]] = {}
+        # id(node) -> (node, folded node)
+        self._fold_cache: Dict[int, Tuple[Object, Object]] = {}
+        # Literal strings recur a lot (tags, keys, ...); remember their C forms
+        self._small_strings: Dict[str, str] = {}
+        self._c_strings: Dict[str, str] = {}
+        # Structurally identical functions share one compiled body
+        self._functions_by_key: Dict[Tuple[str, bool], CompiledFunction] = {}
+        # Sets of closure fields and record keys recur; sort each one once
+        self._sorted_names_cache: Dict[FrozenSet[str], Tuple[str, ...]] = {}
 
     def record_key(self, key: str) -> str:
         if key not in self.record_keys:
@@ -84,14 +213,28 @@ class Compiler:
         result = self._mktemp(f"mkrecord(heap, {len(keys)})")
         for i, key in enumerate(keys):
             key_idx = self.record_key(key)
-            self._emit(f"record_set({result}, /*index=*/{i}, (struct record_field){{.key={key_idx}, .value={key}}});")
-        self._debug("collect(heap);")
+            self._emit(RECORD_SET % (result, i, key_idx, key))
+        self.function.buf += self._debug_prelude
         self._emit(f"return {result};")
 
         self.function = cur
         self.record_builders[keys] = builder
         return builder
 
+    def _sorted_names(self, names: FrozenSet[str]) -> Tuple[str, ...]:
+        result = self._sorted_names_cache.get(names)
+        if result is None:
+            result = self._sorted_names_cache[names] = tuple(sorted(names))
+        return result
+
+    def _sorted_record_keys(self, exp: Record) -> Tuple[str, ...]:
+        cached = self._record_keys_cache.get(id(exp))
+        if cached is not None:
+            return cached[1]
+        keys = self._sorted_names(frozenset(exp.data))
+        self._record_keys_cache[id(exp)] = (exp, keys)
+        return keys
+
     def variant_tag(self, key: str) -> int:
         result = self.variant_tags.get(key)
         if result is not None:
@@ -100,28 +243,38 @@ class Compiler:
         return result
 
     def gensym(self, stem: str = "tmp") -> str:
-        self.gensym_counter += 1
-        return f"{stem}_{self.gensym_counter-1}"
+        if stem == "tmp":
+            idx = self.tmp_counter
+            self.tmp_counter += 1
+            if idx == len(TMP_NAMES):
+                TMP_NAMES.append(f"tmp_{idx}")
+            return TMP_NAMES[idx]
+        idx = self.gensym_counters.get(stem, 0)
+        self.gensym_counters[stem] = idx + 1
+        return f"{stem}_{idx}"
+
+    def _free_in(self, exp: Object) -> FrozenSet[str]:
+        cached = self._free_cache.get(id(exp))
+        if cached is not None:
+            return cached[1]
+        result = free_in(exp)
+        self._free_cache[id(exp)] = (exp, result)
+        return result
 
     def _emit(self, line: str) -> None:
-        self.function.code.append(line)
-
-    def _debug(self, line: str) -> None:
-        if not self.debug:
-            return
-        self._emit("#ifndef NDEBUG")
-        self._emit(line)
-        self._emit("#endif")
+        self.function.emit(line)
 
     def _handle(self, name: str, exp: str) -> str:
-        # TODO(max): Liveness analysis to avoid unnecessary handles
-        self._emit(f"OBJECT_HANDLE({name}, {exp});")
+        # Handles that turn out not to be needed are removed after the fact by
+        # CompiledFunction.remove_unneeded_handles
+        self._emit(OBJECT_HANDLE % (name, exp))
         return name
 
     def _guard(self, cond: str, msg: Optional[str] = None) -> None:
         if msg is None:
             msg = f"assertion {cond!s} failed"
-        self._emit(f"if (!({cond})) {{")
+        # Guards only fail on ill-typed programs; keep the abort path out of line
+        self._emit(f"if (UNLIKELY(!({cond}))) {{")
         self._emit(f'fprintf(stderr, "{msg}\\n");')
         self._emit("abort();")
         self._emit("}")
@@ -144,20 +297,20 @@ class Compiler:
         if isinstance(exp.value, Function):
             # Named function
             value = self.compile_function(env, exp.value, name)
-            return {**env, name: value}
+            return env.new_child({name: value})
         if isinstance(exp.value, MatchFunction):
             # Named match function
             value = self.compile_match_function(env, exp.value, name)
-            return {**env, name: value}
+            return env.new_child({name: value})
         value = self.compile(env, exp.value)
-        return {**env, name: value}
+        return env.new_child({name: value})
 
     def make_compiled_function(self, arg: str, exp: Object, name: Optional[str]) -> CompiledFunction:
         assert isinstance(exp, (Function, MatchFunction))
-        free = free_in(exp)
+        free = self._free_in(exp)
         if name is not None and name in free:
-            free.remove(name)
-        fields = sorted(free)
+            free = free - {name}
+        fields = self._sorted_names(free)
         fn_name = self.gensym(name if name else "fn")  # must be globally unique
         return CompiledFunction(fn_name, params=["this", arg], fields=fields)
 
@@ -166,108 +319,219 @@ class Compiler:
         if name is not None:
             result[name] = "this"
         for i, field in enumerate(fn.fields):
-            result[field] = self._mktemp(f"closure_get(this, /*{field}=*/{i})")
-        return result
+            temp = result[field] = self._mktemp(CLOSURE_GET % (field, i))
+            fn.closure_slots[temp] = i
+        return collections.ChainMap(result)
+
+    def _function_key(self, exp: Object, name: Optional[str]) -> Tuple[str, bool]:
+        # The body of a compiled function depends only on the expression and
+        # on whether it refers to itself by name (compiled to `this`); its
+        # environment is built from its own parameters and fields.
+        return (repr(exp), name is not None and name in self._free_in(exp))
 
     def compile_function(self, env: Env, exp: Function, name: Optional[str]) -> str:
         assert isinstance(exp.arg, Var)
-        fn = self.make_compiled_function(exp.arg.name, exp, name)
-        self.functions.append(fn)
-        cur = self.function
-        self.function = fn
-        funcenv = self.compile_function_env(fn, name)
-        val = self.compile(funcenv, exp.body)
-        fn.code.append(f"return {val};")
-        self.function = cur
+        key = self._function_key(exp, name)
+        fn = self._functions_by_key.get(key)
+        if fn is None:
+            fn = self.make_compiled_function(exp.arg.name, exp, name)
+            self._functions_by_key[key] = fn
+            self.functions.append(fn)
+            cur = self.function
+            self.function = fn
+            funcenv = self.compile_function_env(fn, name)
+            val = self.compile(funcenv, exp.body)
+            fn.emit(f"return {val};")
+            self.function = cur
         if not fn.fields:
             # TODO(max): Closure over freevars but only consts
             return self._const_closure(fn)
         return self.make_closure(env, fn)
 
-    def try_match(self, env: Env, arg: str, pattern: Object, fallthrough: str) -> Env:
+    def try_match(self, env: Env, arg: str, pattern: Object, fallthrough: str) -> Dict[str, str]:
         # TODO(max): Give `arg` an AST node so we can track its inferred type
         # and make use of that in pattern matching
-        if isinstance(pattern, Int):
-            self._emit(f"if (!is_num_equal_word({arg}, {pattern.value})) {{ goto {fallthrough}; }}")
-            return {}
-        if isinstance(pattern, Hole):
-            self._emit(f"if (!is_hole({arg})) {{ goto {fallthrough}; }}")
+        matcher = self._MATCH_TABLE.get(type(pattern))
+        if matcher is None:
+            raise NotImplementedError("try_match", pattern)
+        return matcher(self, env, arg, pattern, fallthrough)
+
+    def _match_int(self, env: Env, arg: str, pattern: Int, fallthrough: str) -> Dict[str, str]:
+        self._emit(f"if (!is_num_equal_word({arg}, {pattern.value})) {{ goto {fallthrough}; }}")
+        return {}
+
+    def _match_hole(self, env: Env, arg: str, pattern: Hole, fallthrough: str) -> Dict[str, str]:
+        self._emit(f"if (!is_hole({arg})) {{ goto {fallthrough}; }}")
+        return {}
+
+    def _match_variant(self, env: Env, arg: str, pattern: Variant, fallthrough: str) -> Dict[str, str]:
+        self.variant_tag(pattern.tag)  # register it for the big enum
+        if isinstance(pattern.value, Hole):
+            # This is an optimization for immediate variants but it's not
+            # necessary; the non-Hole case would work just fine.
+            self._emit(f"if ({arg} != mk_immediate_variant(Tag_{pattern.tag})) {{ goto {fallthrough}; }}")
             return {}
-        if isinstance(pattern, Variant):
-            self.variant_tag(pattern.tag)  # register it for the big enum
-            if isinstance(pattern.value, Hole):
-                # This is an optimization for immediate variants but it's not
-                # necessary; the non-Hole case would work just fine.
-                self._emit(f"if ({arg} != mk_immediate_variant(Tag_{pattern.tag})) {{ goto {fallthrough}; }}")
-                return {}
-            self._emit(f"if (!is_variant({arg})) {{ goto {fallthrough}; }}")
-            self._emit(f"if (variant_tag({arg}) != Tag_{pattern.tag}) {{ goto {fallthrough}; }}")
-            return self.try_match(env, self._mktemp(f"variant_value({arg})"), pattern.value, fallthrough)
-
-        if isinstance(pattern, String):
-            value = pattern.value
-            if len(value) < 8:
-                self._emit(f"if ({arg} != mksmallstring({json.dumps(value)}, {len(value)})) {{ goto {fallthrough}; }}")
-                return {}
-            self._emit(f"if (!is_string({arg})) {{ goto {fallthrough}; }}")
-            self._emit(
-                f"if (!string_equal_cstr_len({arg}, {json.dumps(value)}, {len(value)})) {{ goto {fallthrough}; }}"
-            )
+        self._emit(f"if (!is_variant({arg})) {{ goto {fallthrough}; }}")
+        self._emit(f"if (variant_tag({arg}) != Tag_{pattern.tag}) {{ goto {fallthrough}; }}")
+        return self.try_match(env, self._mktemp(f"variant_value({arg})"), pattern.value, fallthrough)
+
+    def _match_string(self, env: Env, arg: str, pattern: String, fallthrough: str) -> Dict[str, str]:
+        value = pattern.value
+        if len(value) < 8:
+            self._emit(f"if ({arg} != mksmallstring({self._c_string(value)}, {len(value)})) {{ goto {fallthrough}; }}")
             return {}
-        if isinstance(pattern, Var):
-            return {pattern.name: arg}
-        if isinstance(pattern, List):
-            self._emit(f"if (!is_list({arg})) {{ goto {fallthrough}; }}")
-            updates = {}
-            the_list = arg
-            use_spread = False
-            for i, pattern_item in enumerate(pattern.items):
-                if isinstance(pattern_item, Spread):
-                    use_spread = True
-                    if pattern_item.name:
-                        updates[pattern_item.name] = the_list
-                    break
-                # Not enough elements
-                self._emit(f"if (is_empty_list({the_list})) {{ goto {fallthrough}; }}")
-                list_item = self._mktemp(f"list_first({the_list})")
-                updates.update(self.try_match(env, list_item, pattern_item, fallthrough))
-                the_list = self._mktemp(f"list_rest({the_list})")
-            if not use_spread:
-                # Too many elements
-                self._emit(f"if (!is_empty_list({the_list})) {{ goto {fallthrough}; }}")
-            return updates
-        if isinstance(pattern, Record):
+        self._emit(f"if (!is_string({arg})) {{ goto {fallthrough}; }}")
+        self._emit(
+            f"if (!string_equal_cstr_len({arg}, {self._c_string(value)}, {len(value)})) {{ goto {fallthrough}; }}"
+        )
+        return {}
+
+    def _match_var(self, env: Env, arg: str, pattern: Var, fallthrough: str) -> Dict[str, str]:
+        return {pattern.name: arg}
+
+    def _match_list(self, env: Env, arg: str, pattern: List, fallthrough: str) -> Dict[str, str]:
+        self._emit(f"if (!is_list({arg})) {{ goto {fallthrough}; }}")
+        updates = {}
+        the_list = arg
+        use_spread = False
+        for i, pattern_item in enumerate(pattern.items):
+            if isinstance(pattern_item, Spread):
+                use_spread = True
+                if pattern_item.name:
+                    updates[pattern_item.name] = the_list
+                break
+            # Not enough elements
+            self._emit(GOTO_IF_EMPTY_LIST % (the_list, fallthrough))
+            list_item = self._mktemp(LIST_FIRST % the_list)
+            updates.update(self.try_match(env, list_item, pattern_item, fallthrough))
+            the_list = self._mktemp(LIST_REST % the_list)
+        if not use_spread:
+            # Too many elements
+            self._emit(GOTO_IF_NOT_EMPTY_LIST % (the_list, fallthrough))
+        return updates
+
+    def _match_record(self, env: Env, arg: str, pattern: Record, fallthrough: str) -> Dict[str, str]:
+        # If the program has been type checked, the pattern's type is the type
+        # of the value being matched and the checks it guarantees can go. Only
+        # read the annotation: type_of would attach a fresh type variable to
+        # an unchecked pattern.
+        pattern_type = getattr(pattern, "inferred_type", None)
+        if pattern_type is not None:
+            pattern_type = pattern_type.find()
+        known_keys: typing.Container[str] = ()
+        if isinstance(pattern_type, TyRow):
+            known_keys = row_flatten(pattern_type)[0]
+        else:
             self._emit(f"if (!is_record({arg})) {{ goto {fallthrough}; }}")
-            updates = {}
-            use_spread = False
-            for key, pattern_value in pattern.data.items():
-                if isinstance(pattern_value, Spread):
-                    use_spread = True
-                    if pattern_value.name:
-                        raise NotImplementedError("named record spread not yet supported")
-                    break
-                key_idx = self.record_key(key)
-                record_value = self._mktemp(f"record_get({arg}, {key_idx})")
-                # TODO(max): If the key is present in the type, don't emit this
-                # check
-                self._emit(f"if ({record_value} == NULL) {{ goto {fallthrough}; }}")
-                updates.update(self.try_match(env, record_value, pattern_value, fallthrough))
-            if not use_spread:
-                self._emit(f"if (record_num_fields({arg}) != {len(pattern.data)}) {{ goto {fallthrough}; }}")
-            return updates
-        raise NotImplementedError("try_match", pattern)
+        updates = {}
+        use_spread = False
+        for key, pattern_value in pattern.data.items():
+            if isinstance(pattern_value, Spread):
+                use_spread = True
+                if pattern_value.name:
+                    raise NotImplementedError("named record spread not yet supported")
+                break
+            key_idx = self.record_key(key)
+            record_value = self._mktemp(RECORD_GET % (arg, key_idx))
+            if key not in known_keys:
+                self._emit(GOTO_IF_NULL % (record_value, fallthrough))
+            updates.update(self.try_match(env, record_value, pattern_value, fallthrough))
+        if not use_spread:
+            self._emit(f"if (record_num_fields({arg}) != {len(pattern.data)}) {{ goto {fallthrough}; }}")
+        return updates
+
+    _MATCH_TABLE: Dict[type, Callable[..., Dict[str, str]]] = {
+        Int: _match_int,
+        Hole: _match_hole,
+        Variant: _match_variant,
+        String: _match_string,
+        Var: _match_var,
+        List: _match_list,
+        Record: _match_record,
+    }
 
     def compile_match_function(self, env: Env, exp: MatchFunction, name: Optional[str]) -> str:
+        key = self._function_key(exp, name)
+        fn = self._functions_by_key.get(key)
+        if fn is None:
+            fn = self._compile_match_function_body(exp, name)
+            self._functions_by_key[key] = fn
+        if not fn.fields:
+            # TODO(max): Closure over freevars but only consts
+            return self._const_closure(fn)
+        return self.make_closure(env, fn)
+
+    def _switch_dispatch(self, arg: str, cases: typing.List[MatchCase]) -> Optional[typing.Set[int]]:
+        """If the cases are a run of Int or immediate variant literals,
+        optionally followed by a catch-all variable, emit a C switch that
+        jumps to case_N for the matching case and return the indices of the
+        cases it can reach. Otherwise emit nothing and return None."""
+        literals = cases
+        default = "no_match"
+        reachable = set()
+        if cases and isinstance(cases[-1].pattern, Var):
+            reachable.add(len(cases) - 1)
+            literals = cases[:-1]
+            default = f"case_{len(cases) - 1}"
+        # A chain of one or two compares is as good as a switch
+        if len(literals) < 2:
+            return None
+        if all(isinstance(case.pattern, Int) for case in literals):
+            values = [typing.cast(Int, case.pattern).value for case in literals]
+            if not all(SMALL_INT_MIN <= value <= SMALL_INT_MAX for value in values):
+                return None
+            self._emit(f"if (!is_num({arg})) {{ goto {default}; }}")
+            self._emit(f"switch (num_value({arg})) {{")
+            labels = [str(value) for value in values]
+        elif all(isinstance(case.pattern, Variant) and isinstance(case.pattern.value, Hole) for case in literals):
+            tags = [typing.cast(Variant, case.pattern).tag for case in literals]
+            for tag in tags:
+                self.variant_tag(tag)  # register it for the big enum
+            self._emit(f"if (!is_immediate_variant({arg})) {{ goto {default}; }}")
+            self._emit(f"switch (immediate_variant_tag({arg})) {{")
+            labels = [f"Tag_{tag}" for tag in tags]
+        else:
+            return None
+        seen = set()
+        for i, label in enumerate(labels):
+            # The first of several equal patterns wins
+            if label not in seen:
+                seen.add(label)
+                reachable.add(i)
+                self._emit(f"case {label}: goto case_{i};")
+        self._emit(f"default: goto {default};")
+        self._emit("}")
+        return reachable
+
+    def _compile_match_function_body(self, exp: MatchFunction, name: Optional[str]) -> CompiledFunction:
         arg = self.gensym()
         fn = self.make_compiled_function(arg, exp, name)
         self.functions.append(fn)
         cur = self.function
         self.function = fn
         funcenv = self.compile_function_env(fn, name)
+        reachable = self._switch_dispatch(arg, exp.cases)
+        if reachable is not None:
+            # Each case is reached only through the switch
+            for i, case in enumerate(exp.cases):
+                if i not in reachable:
+                    continue
+                self._emit(f"case_{i}:;")
+                env_updates = {case.pattern.name: arg} if isinstance(case.pattern, Var) else {}
+                case_result = self.compile(funcenv.new_child(env_updates), case.body)
+                self._emit(f"return {case_result};")
+            if not isinstance(exp.cases[-1].pattern, Var):
+                self._emit("no_match:;")
+                self._emit(r'fprintf(stderr, "no matching cases\n");')
+                self._emit("abort();")
+                # Pacify the C compiler
+                self._emit("return NULL;")
+            self.function = cur
+            return fn
         for i, case in enumerate(exp.cases):
             fallthrough = f"case_{i+1}" if i < len(exp.cases) - 1 else "no_match"
             env_updates = self.try_match(funcenv, arg, case.pattern, fallthrough)
-            case_result = self.compile({**funcenv, **env_updates}, case.body)
+            case_result = self.compile(funcenv.new_child(env_updates), case.body)
             self._emit(f"return {case_result};")
             self._emit(f"{fallthrough}:;")
         self._emit(r'fprintf(stderr, "no matching cases\n");')
@@ -275,16 +539,27 @@ class Compiler:
         # Pacify the C compiler
         self._emit("return NULL;")
         self.function = cur
-        if not fn.fields:
-            # TODO(max): Closure over freevars but only consts
-            return self._const_closure(fn)
-        return self.make_closure(env, fn)
+        return fn
 
     def make_closure(self, env: Env, fn: CompiledFunction) -> str:
         name = self._mktemp(f"mkclosure(heap, {fn.name}, {len(fn.fields)})")
-        for i, field in enumerate(fn.fields):
-            self._emit(f"closure_set({name}, /*{field}=*/{i}, {env[field]});")
-        self._debug("collect(heap);")
+        # Fields are sorted, so values forwarded from the enclosing closure
+        # often sit in consecutive slots of both closures. Copy those in bulk.
+        slots = self.function.closure_slots
+        i = 0
+        while i < len(fn.fields):
+            src = slots.get(env[fn.fields[i]])
+            count = 1
+            if src is not None:
+                while i + count < len(fn.fields) and slots.get(env[fn.fields[i + count]]) == src + count:
+                    count += 1
+            if count > 1:
+                self._emit(f"closure_copy_from({name}, this, /*src_start=*/{src}, /*dst_start=*/{i}, {count});")
+            else:
+                field = fn.fields[i]
+                self._emit(CLOSURE_SET % (name, field, i, env[field]))
+            i += count
+        self.function.buf += self._debug_prelude
         return name
 
     def _is_const(self, exp: Object) -> bool:
@@ -300,14 +575,20 @@ class Compiler:
             return all(self._is_const(item) for item in exp.items)
         if isinstance(exp, Hole):
             return True
-        if isinstance(exp, Function) and len(free_in(exp)) == 0:
+        if isinstance(exp, Function) and not self._free_in(exp):
             return True
         return False
 
     def _const_obj(self, type: str, tag: str, contents: str) -> str:
+        # Const heap objects are immutable, so identical ones can be shared
+        key = (type, tag, contents)
+        cached = self._const_objs.get(key)
+        if cached is not None:
+            return cached
         result = self.gensym(f"const_{type}")
         self.const_heap.append(f"CONST_HEAP struct {type} {result} = {{.HEAD.tag={tag}, {contents} }};")
-        return f"ptrto({result})"
+        ptr = self._const_objs[key] = f"ptrto({result})"
+        return ptr
 
     def _const_cons(self, first: str, rest: str) -> str:
         return self._const_obj("list", "TAG_LIST", f".first={first}, .rest={rest}")
@@ -316,12 +597,24 @@ class Compiler:
         assert len(fn.fields) == 0
         return self._const_obj("closure", "TAG_CLOSURE", f".fn={fn.name}, .size=0")
 
+    def _c_string(self, value: str) -> str:
+        result = self._c_strings.get(value)
+        if result is None:
+            result = self._c_strings[value] = json.dumps(value)
+        return result
+
     def _emit_small_string(self, value_str: str) -> str:
+        result = self._small_strings.get(value_str)
+        if result is not None:
+            return result
         value = value_str.encode("utf-8")
         length = len(value)
         assert length < 8, "small string must be less than 8 bytes"
         value_int = int.from_bytes(value, "little")
-        return f"(struct object*)(({hex(value_int)}ULL << kBitsPerByte) | ({length}ULL << kImmediateTagBits) | (uword)kSmallStringTag /* {value_str!r} */)"
+        result = self._small_strings[value_str] = (
+            f"(struct object*)(({hex(value_int)}ULL << kBitsPerByte) | ({length}ULL << kImmediateTagBits) | (uword)kSmallStringTag /* {value_str!r} */)"
+        )
+        return result
 
     def _emit_const(self, exp: Object) -> str:
         assert self._is_const(exp), f"not a constant {exp}"
@@ -340,7 +633,7 @@ class Compiler:
             if len(exp.value) < 8:
                 return self._emit_small_string(exp.value)
             return self._const_obj(
-                "heap_string", "TAG_STRING", f".size={len(exp.value)}, .data={json.dumps(exp.value)}"
+                "heap_string", "TAG_STRING", f".size={len(exp.value)}, .data={self._c_string(exp.value)}"
             )
         if isinstance(exp, Variant):
             self.variant_tag(exp.tag)
@@ -353,108 +646,195 @@ class Compiler:
             fields = ",\n".join(f"{{.key={key}, .value={value} }}" for key, value in values.items())
             return self._const_obj("record", "TAG_RECORD", f".size={len(values)}, .fields={{ {fields} }}")
         if isinstance(exp, Function):
-            assert len(free_in(exp)) == 0, "only constant functions can be constified"
-            return self.compile_function({}, exp, name=None)
+            assert not self._free_in(exp), "only constant functions can be constified"
+            return self.compile_function(collections.ChainMap(), exp, name=None)
         raise NotImplementedError(f"const {exp}")
 
+    def _fold(self, exp: Object) -> Object:
+        if not isinstance(exp, Binop):
+            return exp
+        cached = self._fold_cache.get(id(exp))
+        if cached is not None:
+            return cached[1]
+        result = self._fold_binop(exp)
+        self._fold_cache[id(exp)] = (exp, result)
+        return result
+
+    def _fold_binop(self, exp: Binop) -> Object:
+        left = self._fold(exp.left)
+        right = self._fold(exp.right)
+        if isinstance(left, Int) and isinstance(right, Int):
+            if exp.op == BinopKind.ADD:
+                value = left.value + right.value
+            elif exp.op == BinopKind.SUB:
+                value = left.value - right.value
+            elif exp.op == BinopKind.MUL:
+                value = left.value * right.value
+            else:
+                return exp
+            if SMALL_INT_MIN <= value <= SMALL_INT_MAX:
+                return Int(value)
+            # TODO(max): Bignum
+            return exp
+        if exp.op == BinopKind.STRING_CONCAT and isinstance(left, String) and isinstance(right, String):
+            return String(left.value + right.value)
+        if exp.op == BinopKind.LIST_CONS and isinstance(right, List) and self._is_const(right) and self._is_const(left):
+            return List([left, *right.items])
+        return exp
+
     def compile(self, env: Env, exp: Object) -> str:
+        exp = self._fold(exp)
         if self._is_const(exp):
             return self._emit_const(exp)
-        if isinstance(exp, Variant):
-            assert not isinstance(exp.value, Hole), "immediate variant should be handled in _emit_const"
-            assert not self._is_const(exp.value), "const heap variant should be handled in _emit_const"
-            self._debug("collect(heap);")
-            self.variant_tag(exp.tag)
-            value = self.compile(env, exp.value)
-            result = self._mktemp(f"mkvariant(heap, Tag_{exp.tag})")
-            self._emit(f"variant_set({result}, {value});")
-            return result
-        if isinstance(exp, String):
-            assert len(exp.value.encode("utf-8")) >= 8, "small string should be handled in _emit_const"
-            self._debug("collect(heap);")
-            string_repr = json.dumps(exp.value)
-            return self._mktemp(f"mkstring(heap, {string_repr}, {len(exp.value)});")
-        if isinstance(exp, Binop):
-            left = self.compile(env, exp.left)
-            right = self.compile(env, exp.right)
-            if exp.op == BinopKind.ADD:
-                self._debug("collect(heap);")
-                self._guard_int(exp.left, left)
-                self._guard_int(exp.right, right)
-                return self._mktemp(f"num_add({left}, {right})")
-            if exp.op == BinopKind.MUL:
-                self._debug("collect(heap);")
-                self._guard_int(exp.left, left)
-                self._guard_int(exp.right, right)
-                return self._mktemp(f"num_mul({left}, {right})")
-            if exp.op == BinopKind.SUB:
-                self._debug("collect(heap);")
-                self._guard_int(exp.left, left)
-                self._guard_int(exp.right, right)
-                return self._mktemp(f"num_sub({left}, {right})")
-            if exp.op == BinopKind.LIST_CONS:
-                self._debug("collect(heap);")
-                return self._mktemp(f"list_cons({left}, {right})")
-            if exp.op == BinopKind.STRING_CONCAT:
-                self._debug("collect(heap);")
-                self._guard_str(exp.left, left)
-                self._guard_str(exp.right, right)
-                return self._mktemp(f"string_concat({left}, {right})")
+        compiler = self._COMPILE_TABLE.get(type(exp))
+        if compiler is None:
+            raise NotImplementedError(f"exp {type(exp)} {exp}")
+        return compiler(self, env, exp)
+
+    def _compile_variant(self, env: Env, exp: Variant) -> str:
+        assert not isinstance(exp.value, Hole), "immediate variant should be handled in _emit_const"
+        assert not self._is_const(exp.value), "const heap variant should be handled in _emit_const"
+        self.function.buf += self._debug_prelude
+        self.variant_tag(exp.tag)
+        value = self.compile(env, exp.value)
+        result = self._mktemp(f"mkvariant(heap, Tag_{exp.tag})")
+        self._emit(f"variant_set({result}, {value});")
+        return result
+
+    def _compile_string(self, env: Env, exp: String) -> str:
+        assert len(exp.value.encode("utf-8")) >= 8, "small string should be handled in _emit_const"
+        self.function.buf += self._debug_prelude
+        string_repr = self._c_string(exp.value)
+        return self._mktemp(f"mkstring(heap, {string_repr}, {len(exp.value)});")
+
+    def _compile_binop(self, env: Env, exp: Binop) -> str:
+        left = self.compile(env, exp.left)
+        right = self.compile(env, exp.right)
+        compiler = self._BINOP_TABLE.get(exp.op)
+        if compiler is None:
             raise NotImplementedError(f"binop {exp.op}")
-        if isinstance(exp, Where):
-            assert isinstance(exp.binding, Assign)
-            res_env = self.compile_assign(env, exp.binding)
-            new_env = {**env, **res_env}
-            return self.compile(new_env, exp.body)
-        if isinstance(exp, Var):
-            var_value = env.get(exp.name)
-            if var_value is None:
-                raise NameError(f"name '{exp.name}' is not defined")
-            return var_value
-        if isinstance(exp, Apply):
-            callee = self.compile(env, exp.func)
+        return compiler(self, exp, left, right)
+
+    def _compile_add(self, exp: Binop, left: str, right: str) -> str:
+        self.function.buf += self._debug_prelude
+        self._guard_int(exp.left, left)
+        self._guard_int(exp.right, right)
+        return self._mktemp(f"num_add({left}, {right})")
+
+    def _compile_mul(self, exp: Binop, left: str, right: str) -> str:
+        self.function.buf += self._debug_prelude
+        self._guard_int(exp.left, left)
+        self._guard_int(exp.right, right)
+        return self._mktemp(f"num_mul({left}, {right})")
+
+    def _compile_sub(self, exp: Binop, left: str, right: str) -> str:
+        self.function.buf += self._debug_prelude
+        self._guard_int(exp.left, left)
+        self._guard_int(exp.right, right)
+        return self._mktemp(f"num_sub({left}, {right})")
+
+    def _compile_list_cons(self, exp: Binop, left: str, right: str) -> str:
+        self.function.buf += self._debug_prelude
+        return self._mktemp(f"list_cons({left}, {right})")
+
+    def _compile_string_concat(self, exp: Binop, left: str, right: str) -> str:
+        self.function.buf += self._debug_prelude
+        self._guard_str(exp.left, left)
+        self._guard_str(exp.right, right)
+        return self._mktemp(f"string_concat({left}, {right})")
+
+    _BINOP_TABLE: Dict[BinopKind, Callable[["Compiler", Binop, str, str], str]] = {
+        BinopKind.ADD: _compile_add,
+        BinopKind.MUL: _compile_mul,
+        BinopKind.SUB: _compile_sub,
+        BinopKind.LIST_CONS: _compile_list_cons,
+        BinopKind.STRING_CONCAT: _compile_string_concat,
+    }
+
+    def _compile_where(self, env: Env, exp: Where) -> str:
+        assert isinstance(exp.binding, Assign)
+        new_env = self.compile_assign(env, exp.binding)
+        return self.compile(new_env, exp.body)
+
+    def _compile_var(self, env: Env, exp: Var) -> str:
+        var_value = env.get(exp.name)
+        if var_value is None:
+            raise NameError(f"name '{exp.name}' is not defined")
+        return var_value
+
+    def _compile_apply(self, env: Env, exp: Apply) -> str:
+        if isinstance(exp.func, Function):
+            # Immediately applied anonymous function: bind the argument and
+            # compile the body in place instead of making a closure. An
+            # anonymous function cannot refer to itself.
+            assert isinstance(exp.func.arg, Var)
             arg = self.compile(env, exp.arg)
-            return self._mktemp(f"closure_call({callee}, {arg})")
-        if isinstance(exp, List):
-            items = [self.compile(env, item) for item in exp.items]
-            result = self._mktemp("empty_list()")
-            for item in reversed(items):
-                result = self._mktemp(f"list_cons({item}, {result})")
-            self._debug("collect(heap);")
-            return result
-        if isinstance(exp, Record):
-            values: Dict[str, str] = {}
-            for key, value_exp in exp.data.items():
-                values[key] = self.compile(env, value_exp)
-            keys = tuple(sorted(exp.data.keys()))
-            builder = self.record_builder(keys)
-            return self._mktemp(f"{builder.name}({', '.join(values[key] for key in keys)})")
-        if isinstance(exp, Access):
-            assert isinstance(exp.at, Var), f"only Var access is supported, got {type(exp.at)}"
-            record = self.compile(env, exp.obj)
-            key_idx = self.record_key(exp.at.name)
-            # Check if the record is a record
-            self._guard(f"is_record({record})", "not a record")
-            value = self._mktemp(f"record_get({record}, {key_idx})")
-            self._guard(f"{value} != NULL", f"missing key {exp.at.name!s}")
-            return value
-        if isinstance(exp, Function):
-            # Anonymous function
-            return self.compile_function(env, exp, name=None)
-        if isinstance(exp, MatchFunction):
-            # Anonymous match function
-            return self.compile_match_function(env, exp, name=None)
-        raise NotImplementedError(f"exp {type(exp)} {exp}")
+            return self.compile(env.new_child({exp.func.arg.name: arg}), exp.func.body)
+        callee = self.compile(env, exp.func)
+        arg = self.compile(env, exp.arg)
+        return self._mktemp(f"closure_call({callee}, {arg})")
+
+    def _compile_list(self, env: Env, exp: List) -> str:
+        items = [self.compile(env, item) for item in exp.items]
+        result = self._mktemp("empty_list()")
+        for item in reversed(items):
+            result = self._mktemp(LIST_CONS % (item, result))
+        self.function.buf += self._debug_prelude
+        return result
+
+    def _compile_record(self, env: Env, exp: Record) -> str:
+        values: Dict[str, str] = {}
+        for key, value_exp in exp.data.items():
+            values[key] = self.compile(env, value_exp)
+        keys = self._sorted_record_keys(exp)
+        builder = self.record_builder(keys)
+        return self._mktemp(f"{builder.name}({', '.join(values[key] for key in keys)})")
+
+    def _compile_access(self, env: Env, exp: Access) -> str:
+        assert isinstance(exp.at, Var), f"only Var access is supported, got {type(exp.at)}"
+        record = self.compile(env, exp.obj)
+        key_idx = self.record_key(exp.at.name)
+        # Check if the record is a record
+        self._guard(f"is_record({record})", "not a record")
+        value = self._mktemp(f"record_get({record}, {key_idx})")
+        self._guard(f"{value} != NULL", f"missing key {exp.at.name!s}")
+        return value
+
+    def _compile_function(self, env: Env, exp: Function) -> str:
+        # Anonymous function
+        return self.compile_function(env, exp, name=None)
+
+    def _compile_match_function(self, env: Env, exp: MatchFunction) -> str:
+        # Anonymous match function
+        return self.compile_match_function(env, exp, name=None)
+
+    _COMPILE_TABLE: Dict[type, Callable[..., str]] = {
+        Variant: _compile_variant,
+        String: _compile_string,
+        Binop: _compile_binop,
+        Where: _compile_where,
+        Var: _compile_var,
+        Apply: _compile_apply,
+        List: _compile_list,
+        Record: _compile_record,
+        Access: _compile_access,
+        Function: _compile_function,
+        MatchFunction: _compile_match_function,
+    }
 
 
 def compile_to_string(program: Object, debug: bool) -> str:
+    f = io.StringIO()
+    compile_to_file(program, debug, f)
+    return f.getvalue()
+
+
+def compile_to_file(program: Object, debug: bool, f: typing.IO[str]) -> None:
     main_fn = CompiledFunction("scrap_main", params=[])
-    compiler = Compiler(main_fn)
-    compiler.debug = debug
-    result = compiler.compile({}, program)
-    main_fn.code.append(f"return {result};")
+    compiler = Compiler(main_fn, debug)
+    result = compiler.compile(collections.ChainMap(), program)
+    main_fn.emit(f"return {result};")
 
-    f = io.StringIO()
     constants = [
         ("uword", "kKiB", 1024),
         ("uword", "kMiB", "kKiB * kKiB"),
@@ -529,8 +909,7 @@ def compile_to_string(program: Object, debug: bool) -> str:
     for line in compiler.const_heap:
         print(line, file=f)
     for function in compiler.functions:
+        function.remove_unneeded_handles()
         print(f"{function.decl()} {{", file=f)
-        for line in function.code:
-            print(line, file=f)
+        f.write(function.buf.decode())
         print("}", file=f)
-    return f.getvalue()
@@ -1,12 +1,24 @@
 import os
+import re
 import unittest
 import subprocess
 
-from scrapscript import env_get_split, discover_cflags, parse, tokenize
+from scrapscript import (
+    env_get_split,
+    discover_cflags,
+    infer_type,
+    parse,
+    tokenize,
+    Assign,
+    MatchFunction,
+    Object,
+    Where,
+    OP_ENV,
+)
 from compiler import compile_to_string
 
 
-def compile_to_binary(source: str, memory: int, debug: bool) -> str:
+def compile_to_binary(source: str, memory: int, debug: bool, check: bool = False) -> str:
     import shlex
     import subprocess
     import sysconfig
@@ -16,6 +28,8 @@ def compile_to_binary(source: str, memory: int, debug: bool) -> str:
     cflags = discover_cflags(cc, debug)
     cflags += [f"-DMEMORY_SIZE={memory}"]
     program = parse(tokenize(source))
+    if check:
+        infer_type(program, OP_ENV)
     c_code = compile_to_string(program, debug)
     with tempfile.NamedTemporaryFile(mode="w", suffix=".c", delete=False) as c_file:
         c_file.write(c_code)
@@ -29,9 +43,9 @@ def compile_to_binary(source: str, memory: int, debug: bool) -> str:
 
 
 class CompilerEndToEndTests(unittest.TestCase):
-    def _run(self, code: str) -> str:
+    def _run(self, code: str, check: bool = False) -> str:
         use_valgrind = bool(os.environ.get("USE_VALGRIND", False))
-        binary = compile_to_binary(code, memory=4096, debug=True)
+        binary = compile_to_binary(code, memory=4096, debug=True, check=check)
         if use_valgrind:
             cmd = ["valgrind", binary]
         else:
@@ -54,12 +68,18 @@ class CompilerEndToEndTests(unittest.TestCase):
     def test_heap_string_concat(self) -> None:
         self.assertEqual(self._run('"hello world" ++ " and goodbye"'), '"hello world and goodbye"\n')
 
+    def test_string_concat_var(self) -> None:
+        self.assertEqual(self._run('a ++ " world" . a = "hello"'), '"hello world"\n')
+
     def test_const_list(self) -> None:
         self.assertEqual(
             self._run("""[1, "2", [3, 4], {a=1}, #foo ()]"""),
             """[1, "2", [3, 4], {a = 1}, #foo ()]\n""",
         )
 
+    def test_const_list_shared_tail(self) -> None:
+        self.assertEqual(self._run("[[1, 2, 3], [0, 2, 3], [1, 2, 3]]"), "[[1, 2, 3], [0, 2, 3], [1, 2, 3]]\n")
+
     def test_add(self) -> None:
         self.assertEqual(self._run("1 + 2"), "3\n")
 
@@ -69,12 +89,21 @@ class CompilerEndToEndTests(unittest.TestCase):
     def test_mul(self) -> None:
         self.assertEqual(self._run("2 * 3"), "6\n")
 
+    def test_fold_arithmetic(self) -> None:
+        self.assertEqual(self._run("1 + 2 * 3 - 4"), "3\n")
+
+    def test_fold_small_int_max(self) -> None:
+        self.assertEqual(self._run("a + 1 . a = 4611686018427387903 - 1"), "4611686018427387903\n")
+
     def test_list(self) -> None:
         self.assertEqual(self._run("[1, 2, 3]"), "[1, 2, 3]\n")
 
     def test_list_concat(self) -> None:
         self.assertEqual(self._run("0 >+ [1, 2, 3]"), "[0, 1, 2, 3]\n")
 
+    def test_fold_list_concat(self) -> None:
+        self.assertEqual(self._run("0 >+ 1 >+ [2]"), "[0, 1, 2]\n")
+
     def test_var(self) -> None:
         self.assertEqual(self._run("a . a = 1"), "1\n")
 
@@ -102,15 +131,45 @@ class CompilerEndToEndTests(unittest.TestCase):
     def test_function(self) -> None:
         self.assertEqual(self._run("f 1 . f = x -> x + 1"), "2\n")
 
+    def test_nested_closure_forwards_fields(self) -> None:
+        self.assertEqual(self._run("f 1 2 3 4 . f = a -> b -> c -> d -> a + b + c + d"), "10\n")
+
+    def test_identical_functions(self) -> None:
+        self.assertEqual(self._run("[f 1, g 2] . f = x -> x + 1 . g = x -> x + 1"), "[2, 3]\n")
+
+    def test_identical_closures(self) -> None:
+        self.assertEqual(self._run("[(a -> x -> x + a) 1 10, (a -> x -> x + a) 2 20]"), "[11, 22]\n")
+
     def test_anonymous_function_as_value(self) -> None:
         self.assertEqual(self._run("x -> x"), "<closure>\n")
 
     def test_anonymous_function(self) -> None:
         self.assertEqual(self._run("((x -> x + 1) 1)"), "2\n")
 
+    def test_anonymous_function_free_var(self) -> None:
+        self.assertEqual(self._run("(x -> x + a) 1 . a = 2"), "3\n")
+
+    def test_anonymous_function_returns_closure(self) -> None:
+        self.assertEqual(self._run("(x -> y -> x + y) 1 2"), "3\n")
+
+    def test_anonymous_function_shadows(self) -> None:
+        self.assertEqual(self._run("(x -> x) 2 . x = 1"), "2\n")
+
     def test_match_int(self) -> None:
         self.assertEqual(self._run("f 3 . f = | 1 -> 2 | 3 -> 4"), "4\n")
 
+    def test_match_int_switch_default(self) -> None:
+        self.assertEqual(self._run("f 5 . f = | 1 -> 2 | 3 -> 4 | n -> n + 1"), "6\n")
+
+    def test_match_int_switch_non_int(self) -> None:
+        self.assertEqual(self._run('f "x" . f = | 1 -> "a" | 3 -> "b" | x -> x'), '"x"\n')
+
+    def test_match_int_switch_duplicate(self) -> None:
+        self.assertEqual(self._run("f 1 . f = | 1 -> 2 | 1 -> 3"), "2\n")
+
+    def test_match_immediate_variant_switch(self) -> None:
+        self.assertEqual(self._run("f #bar () . f = | #foo () -> 1 | #bar () -> 2 | #baz () -> 3"), "2\n")
+
     def test_match_list(self) -> None:
         self.assertEqual(self._run("f [4, 5] . f = | [1, 2] -> 3 | [4, 5] -> 6"), "6\n")
 
@@ -123,6 +182,14 @@ class CompilerEndToEndTests(unittest.TestCase):
     def test_match_record_too_few_keys(self) -> None:
         self.assertEqual(self._run("f {a = 4, b = 5} . f = | {a = _} -> 3 | {a = _, b = _} -> 6"), "6\n")
 
+    def test_match_record_checked(self) -> None:
+        self.assertEqual(
+            self._run("f {a = 4, b = 5} . f = | {a = 1, b = 2} -> 3 | {a = 4, b = 5} -> 6", check=True), "6\n"
+        )
+
+    def test_match_record_spread_checked(self) -> None:
+        self.assertEqual(self._run("f {a=1, b=2, c=3} . f = | {a=a, ...} -> a", check=True), "1\n")
+
     def test_match_record_spread(self) -> None:
         self.assertEqual(self._run("f {a=1, b=2, c=3} . f = | {a=a, ...} -> a"), "1\n")
 
@@ -154,5 +221,61 @@ countdown 1000
         )
 
 
+class RemoveUnneededHandlesTests(unittest.TestCase):
+    def _function(self, source: str, name: str) -> str:
+        c_code = compile_to_string(parse(tokenize(source)), debug=False)
+        # The body of the definition, not the forward declaration
+        match = re.search(rf"^struct object\* {name}\([^\n]*\) {{\n(.*?)\n}}$", c_code, re.MULTILINE | re.DOTALL)
+        assert match is not None, f"no definition of {name}"
+        return match.group(1)
+
+    def test_keeps_handle_live_across_closure_call(self) -> None:
+        body = self._function("f 1 . f = x -> (x 1) + (x 2)", "f_0")
+        self.assertIn("OBJECT_HANDLE(tmp_0, closure_call(x, _mksmallint(1)));", body)
+
+    def test_drops_handle_not_live_across_safepoint(self) -> None:
+        body = self._function("f 1 . f = x -> (x 1) + (x 2)", "f_0")
+        self.assertIn("struct object* tmp_1 = closure_call(x, _mksmallint(2));", body)
+        self.assertNotIn("OBJECT_HANDLE(tmp_1", body)
+
+    def test_keeps_params_live_across_heap_allocation(self) -> None:
+        body = self._function("f 1 . f = x -> {a = x, b = x}", "Record_builder_a_b")
+        self.assertIn("mkrecord(heap, 2)", body)
+        self.assertIn("GC_PROTECT(a);", body)
+        self.assertIn("GC_PROTECT(b);", body)
+
+    def test_removes_gc_protect_for_param_not_live_across_safepoint(self) -> None:
+        body = self._function("f 1 . f = x -> [x]", "f_0")
+        self.assertIn("list_cons(x, tmp_0)", body)
+        self.assertNotIn("GC_PROTECT(x);", body)
+
+    def test_keeps_gc_protect_for_param_live_across_safepoint(self) -> None:
+        body = self._function("f 1 . f = x -> [x, x]", "f_0")
+        self.assertIn("GC_PROTECT(x);", body)
+
+
+class MatchRecordCodegenTests(unittest.TestCase):
+    SOURCE = "f {a = 1} . f = | {a = a} -> a"
+
+    def _record_pattern(self, program: Object) -> Object:
+        assert isinstance(program, Where)
+        assert isinstance(program.binding, Assign)
+        func = program.binding.value
+        assert isinstance(func, MatchFunction)
+        return func.cases[0].pattern
+
+    def test_unchecked_program_keeps_record_guards_and_ast(self) -> None:
+        program = parse(tokenize(self.SOURCE))
+        c_code = compile_to_string(program, debug=False)
+        self.assertIn("if (!is_record(", c_code)
+        self.assertIsNone(getattr(self._record_pattern(program), "inferred_type", None))
+
+    def test_checked_program_drops_record_guards(self) -> None:
+        program = parse(tokenize(self.SOURCE))
+        infer_type(program, OP_ENV)
+        c_code = compile_to_string(program, debug=False)
+        self.assertNotIn("if (!is_record(", c_code)
+
+
 if __name__ == "__main__":
     unittest.main()
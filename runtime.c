@@ -296,7 +296,9 @@ void collect(struct gc_heap* heap) {
 #endif
 }
 
-#if defined(__builtin_expect)
+// __builtin_expect is not a macro, so `defined(__builtin_expect)` is always
+// false. GCC and Clang (which also defines __GNUC__) both provide it.
+#if defined(__GNUC__)
 #define LIKELY(x) __builtin_expect(!!(x), 1)
 #define UNLIKELY(x) __builtin_expect(!!(x), 0)
 #else
@@ -553,6 +555,15 @@ struct object* closure_get(struct object* closure, size_t i) {
   return c->env[i];
 }
 
+void closure_copy_from(struct object* closure, struct object* src,
+                       size_t src_start, size_t dst_start, size_t count) {
+  struct closure* c = as_closure(closure);
+  struct closure* s = as_closure(src);
+  assert(dst_start + count <= c->size);
+  assert(src_start + count <= s->size);
+  memcpy(&c->env[dst_start], &s->env[src_start], count * kWordSize);
+}
+
 struct object* closure_call(struct object* closure, struct object* arg) {
   ClosureFn fn = closure_fn(closure);
   return fn(closure, arg);
@@ -2,6 +2,7 @@
 from __future__ import annotations
 import argparse
 import base64
+import binascii
 import code
 import dataclasses
 import enum
@@ -18,7 +19,7 @@ import urllib.request
 from dataclasses import dataclass
 from enum import auto
 from types import ModuleType
-from typing import Any, Callable, Dict, Iterator, Mapping, Optional, Set, Tuple, Union
+from typing import Any, Callable, Dict, FrozenSet, Iterator, Mapping, Optional, Set, Tuple, Union
 
 readline: Optional[ModuleType]
 try:
@@ -47,113 +48,177 @@ class SourceExtent:
     end: SourceLocation = dataclasses.field(default_factory=SourceLocation)
 
 
-@dataclass(eq=True)
+# Start (lineno, colno, byteno) followed by end (lineno, colno, byteno)
+Location = Tuple[int, int, int, int, int, int]
+NO_LOCATION: Location = (-1, -1, -1, -1, -1, -1)
+
+
 class Token:
-    source_extent: SourceExtent = dataclasses.field(default_factory=SourceExtent, init=False, compare=False)
+    # Tokens are plain slotted classes rather than dataclasses because the
+    # lexer makes one per token of input and they are on the hot path
+    __slots__ = ("location",)
+    location: Location
+    _fields: Tuple[str, ...] = ()
+
+    def __init__(self) -> None:
+        self.location = NO_LOCATION
+
+    @property
+    def source_extent(self) -> SourceExtent:
+        # Only needed for error reporting, so built on demand
+        start_lineno, start_colno, start_byteno, end_lineno, end_colno, end_byteno = self.location
+        return SourceExtent(
+            SourceLocation(start_lineno, start_colno, start_byteno),
+            SourceLocation(end_lineno, end_colno, end_byteno),
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self._fields)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in ("source_extent",) + self._fields)
+        return f"{type(self).__name__}({fields})"
 
 
-@dataclass(eq=True)
 class IntLit(Token):
+    __slots__ = ("value",)
+    _fields = ("value",)
     value: int
 
+    def __init__(self, value: int) -> None:
+        self.location = NO_LOCATION
+        self.value = value
+
 
-@dataclass(eq=True)
 class FloatLit(Token):
+    __slots__ = ("value",)
+    _fields = ("value",)
     value: float
 
+    def __init__(self, value: float) -> None:
+        self.location = NO_LOCATION
+        self.value = value
+
 
-@dataclass(eq=True)
 class StringLit(Token):
+    __slots__ = ("value",)
+    _fields = ("value",)
     value: str
 
+    def __init__(self, value: str) -> None:
+        self.location = NO_LOCATION
+        self.value = value
+
 
-@dataclass(eq=True)
 class BytesLit(Token):
-    value: str
+    __slots__ = ("value", "base")
+    _fields = ("value", "base")
+    value: bytes
     base: int
 
+    def __init__(self, value: bytes, base: int) -> None:
+        self.location = NO_LOCATION
+        self.value = value
+        self.base = base
+
 
-@dataclass(eq=True)
 class Operator(Token):
+    __slots__ = ("value",)
+    _fields = ("value",)
     value: str
 
+    def __init__(self, value: str) -> None:
+        self.location = NO_LOCATION
+        self.value = value
+
 
-@dataclass(eq=True)
 class Name(Token):
+    __slots__ = ("value",)
+    _fields = ("value",)
     value: str
 
+    def __init__(self, value: str) -> None:
+        self.location = NO_LOCATION
+        self.value = value
+
 
-@dataclass(eq=True)
 class LeftParen(Token):
     # (
-    pass
+    __slots__ = ()
 
 
-@dataclass(eq=True)
 class RightParen(Token):
     # )
-    pass
+    __slots__ = ()
 
 
-@dataclass(eq=True)
 class LeftBrace(Token):
     # {
-    pass
+    __slots__ = ()
 
 
-@dataclass(eq=True)
 class RightBrace(Token):
     # }
-    pass
+    __slots__ = ()
 
 
-@dataclass(eq=True)
 class LeftBracket(Token):
     # [
-    pass
+    __slots__ = ()
 
 
-@dataclass(eq=True)
 class RightBracket(Token):
     # ]
-    pass
+    __slots__ = ()
 
 
-@dataclass(eq=True)
 class Hash(Token):
     # #
-    pass
+    __slots__ = ()
 
 
-@dataclass(eq=True)
 class EOF(Token):
-    pass
+    __slots__ = ()
 
 
 def num_bytes_as_utf8(s: str) -> int:
     return len(s.encode(encoding="UTF-8"))
 
 
+# Runs of characters that the lexer can consume in one go. \w is exactly
+# is_identifier_char minus "$" and "'"; \d is a subset of str.isdigit, so
+# read_number checks for stragglers.
+IDENTIFIER_RE = re.compile(r"[\w$']*")
+NUMBER_RE = re.compile(r"[0-9.]*")
+WHITESPACE_RE = re.compile(r"\s*")
+NON_SPACE_RE = re.compile(r"\S*")
+
+
 class Lexer:
+    __slots__ = (
+        "text",
+        "idx",
+        "_lineno",
+        "_colno",
+        "_line_start",
+        "_byteno",
+        "token_start",
+        "token_end",
+        "token_start_idx",
+        "token_end_idx",
+    )
+
     def __init__(self, text: str):
         self.text: str = text
         self.idx: int = 0
         self._lineno: int = 1
         self._colno: int = 1
-        self.line: str = ""
+        self._line_start: int = 0
         self._byteno: int = 0
-        self.current_token_source_extent: SourceExtent = SourceExtent(
-            start=SourceLocation(
-                lineno=self._lineno,
-                colno=self._colno,
-                byteno=self._byteno,
-            ),
-            end=SourceLocation(
-                lineno=self._lineno,
-                colno=self._colno,
-                byteno=self._byteno,
-            ),
-        )
+        self.token_start: Tuple[int, int, int] = (self._lineno, self._colno, self._byteno)
+        self.token_end: Tuple[int, int, int] = self.token_start
         self.token_start_idx: int = self.idx
         self.token_end_idx: int = self.token_start_idx
 
@@ -169,35 +234,65 @@ class Lexer:
     def byteno(self) -> int:
         return self._byteno
 
+    @property
+    def line(self) -> str:
+        # The part of the current line that has been read so far
+        return self.text[self._line_start : self.idx]
+
+    @property
+    def current_token_source_extent(self) -> SourceExtent:
+        return SourceExtent(SourceLocation(*self.token_start), SourceLocation(*self.token_end))
+
     def mark_token_start(self) -> None:
-        self.current_token_source_extent.start.lineno = self._lineno
-        self.current_token_source_extent.start.colno = self._colno
-        self.current_token_source_extent.start.byteno = self._byteno
+        self.token_start = (self._lineno, self._colno, self._byteno)
         self.token_start_idx = self.idx
 
     def mark_token_end(self) -> None:
-        self.current_token_source_extent.end.lineno = self._lineno
-        self.current_token_source_extent.end.colno = self._colno
-        self.current_token_source_extent.end.byteno = self._byteno
+        self.token_end = (self._lineno, self._colno, self._byteno)
         self.token_end_idx = self.idx
 
     def has_input(self) -> bool:
         return self.idx < len(self.text)
 
     def read_char(self) -> str:
-        self.mark_token_end()
-        c = self.peek_char()
+        # Inlined mark_token_end and peek_char; this runs for every token
+        idx = self.idx
+        self.token_end = (self._lineno, self._colno, self._byteno)
+        self.token_end_idx = idx
+        if idx >= len(self.text):
+            raise UnexpectedEOFError("while reading token")
+        c = self.text[idx]
+        idx += 1
+        self.idx = idx
         if c == "\n":
             self._lineno += 1
             self._colno = 1
-            self.line = ""
+            self._line_start = idx
         else:
-            self.line += c
             self._colno += 1
-        self.idx += 1
-        self._byteno += num_bytes_as_utf8(c)
+        self._byteno += 1 if c < "\x80" else num_bytes_as_utf8(c)
         return c
 
+    def _move_to(self, end: int) -> None:
+        # Consume text[idx:end] in bulk, without marking the token end
+        segment = self.text[self.idx : end]
+        newlines = segment.count("\n")
+        if newlines:
+            self._lineno += newlines
+            self._line_start = self.idx + segment.rfind("\n") + 1
+            self._colno = end - self._line_start + 1
+        else:
+            self._colno += end - self.idx
+        # str.isascii is O(1) in CPython: strings record whether they are ASCII
+        self._byteno += len(segment) if segment.isascii() else num_bytes_as_utf8(segment)
+        self.idx = end
+
+    def read_to(self, end: int) -> None:
+        # Equivalent to calling read_char until idx == end
+        if end > self.idx:
+            self._move_to(end - 1)
+            self.read_char()
+
     def peek_char(self) -> str:
         if not self.has_input():
             raise UnexpectedEOFError("while reading token")
@@ -205,145 +300,137 @@ class Lexer:
 
     def make_token(self, cls: type, *args: Any) -> Token:
         result: Token = cls(*args)
-
-        # Set start of token's source extent
-        result.source_extent.start.lineno = self.current_token_source_extent.start.lineno
-        result.source_extent.start.colno = self.current_token_source_extent.start.colno
-        result.source_extent.start.byteno = self.current_token_source_extent.start.byteno
-
-        # Set end of token's source extent
-        result.source_extent.end.colno = self.current_token_source_extent.end.colno
-        result.source_extent.end.lineno = self.current_token_source_extent.end.lineno
-        result.source_extent.end.byteno = self.current_token_source_extent.end.byteno
-
+        result.location = self.token_start + self.token_end
         return result
 
     def read_token(self) -> Token:
         # Consume all whitespace
-        while self.has_input():
-            # Keep updating the token start location until we exhaust all whitespace
-            self.mark_token_start()
-            c = self.read_char()
-            if not c.isspace():
-                break
-        else:
-            return self.make_token(EOF)
-        if c == '"':
-            return self.read_string()
-        if c == "-":
-            if self.has_input() and self.peek_char() == "-":
-                self.read_comment()
-                # Need to start reading a new token
-                return self.read_token()
-            return self.read_op(c)
-        if c == "#":
-            return self.make_token(Hash)
-        if c == "~":
-            if self.has_input() and self.peek_char() == "~":
+        end = WHITESPACE_RE.match(self.text, self.idx).end()  # type: ignore[union-attr]
+        if end == len(self.text):
+            if end > self.idx:
+                # The EOF token sits on the last whitespace character
+                self._move_to(end - 1)
+                self.mark_token_start()
                 self.read_char()
-                return self.read_bytes()
-            raise ParseError(f"unexpected token {c!r}")
+            return self.make_token(EOF)
+        self._move_to(end)
+        self.mark_token_start()
+        c = self.read_char()
+        code = ord(c)
+        if code < 128:
+            return LEXER_DISPATCH[code](self, c)
+        return self.read_non_ascii(c)
+
+    def read_non_ascii(self, c: str) -> Token:
         if c.isdigit():
             return self.read_number(c)
-        if c in "()[]{}":
-            custom = {
-                "(": LeftParen,
-                ")": RightParen,
-                "{": LeftBrace,
-                "}": RightBrace,
-                "[": LeftBracket,
-                "]": RightBracket,
-            }
-            return self.make_token(custom[c])
-        if c in OPER_CHARS:
-            return self.read_op(c)
         if is_identifier_char(c):
             return self.read_var(c)
-        raise InvalidTokenError(
-            SourceExtent(
-                start=SourceLocation(
-                    lineno=self.current_token_source_extent.start.lineno,
-                    colno=self.current_token_source_extent.start.colno,
-                    byteno=self.current_token_source_extent.start.byteno,
-                ),
-                end=SourceLocation(
-                    lineno=self.current_token_source_extent.end.lineno,
-                    colno=self.current_token_source_extent.end.colno,
-                    byteno=self.current_token_source_extent.end.byteno,
-                ),
-            )
-        )
+        return self.read_invalid(c)
+
+    def read_invalid(self, c: str) -> Token:
+        raise InvalidTokenError(self.current_token_source_extent)
+
+    def read_quote(self, c: str) -> Token:
+        return self.read_string()
+
+    def read_dash(self, c: str) -> Token:
+        if self.has_input() and self.peek_char() == "-":
+            self.read_comment()
+            # Need to start reading a new token
+            return self.read_token()
+        return self.read_op(c)
+
+    def read_hash(self, c: str) -> Token:
+        return self.make_token(Hash)
+
+    def read_tilde(self, c: str) -> Token:
+        if self.has_input() and self.peek_char() == "~":
+            self.read_char()
+            return self.read_bytes()
+        raise ParseError(f"unexpected token {c!r}")
+
+    def read_bracket(self, c: str) -> Token:
+        return self.make_token(BRACKETS[c])
 
     def read_string(self) -> Token:
-        buf = ""
-        while self.has_input():
-            if (c := self.read_char()) == '"':
-                break
-            buf += c
-        else:
+        start = self.idx
+        end = self.text.find('"', start)
+        if end == -1:
+            self.read_to(len(self.text))
             raise UnexpectedEOFError("while reading string")
-        return self.make_token(StringLit, buf)
+        self.read_to(end + 1)
+        return self.make_token(StringLit, self.text[start:end])
 
     def read_comment(self) -> None:
-        while self.has_input() and self.read_char() != "\n":
-            pass
+        end = self.text.find("\n", self.idx)
+        self.read_to(len(self.text) if end == -1 else end + 1)
 
     def read_number(self, first_digit: str) -> Token:
         # TODO: Support floating point numbers with no integer part
-        buf = first_digit
-        has_decimal = False
-        while self.has_input():
-            c = self.peek_char()
-            if c == ".":
-                if has_decimal:
-                    raise ParseError(f"unexpected token {c!r}")
-                has_decimal = True
-            elif not c.isdigit():
-                break
-            self.read_char()
-            buf += c
+        start = self.idx - 1
+        end = NUMBER_RE.match(self.text, self.idx).end()  # type: ignore[union-attr]
+        if end < len(self.text) and self.text[end].isdigit():
+            # Non-ASCII digit
+            end = self._read_number_slow(end)
+        buf = self.text[start:end]
+        has_decimal = "." in buf
+        if buf.count(".") > 1:
+            self.read_to(self.text.index(".", self.text.index(".", start) + 1))
+            raise ParseError("unexpected token '.'")
+        self.read_to(end)
 
         if has_decimal:
             return self.make_token(FloatLit, float(buf))
         return self.make_token(IntLit, int(buf))
 
-    def _starts_operator(self, buf: str) -> bool:
-        # TODO(max): Rewrite using trie
-        return any(op.startswith(buf) for op in PS.keys())
-
     def read_op(self, first_char: str) -> Token:
-        buf = first_char
-        while self.has_input():
-            c = self.peek_char()
-            if not self._starts_operator(buf + c):
-                break
-            self.read_char()
-            buf += c
-        if buf in PS.keys():
+        start = self.idx - 1
+        end = self.idx
+        text = self.text
+        # Operators are at most a few characters long, so extend greedily for
+        # as long as the text read so far is a prefix of some operator
+        while end < len(text) and text[start : end + 1] in OPER_PREFIXES:
+            end += 1
+        self.read_to(end)
+        buf = text[start:end]
+        if buf in PS:
             return self.make_token(Operator, buf)
         raise ParseError(f"unexpected token {buf!r}")
 
+    def _read_number_slow(self, end: int) -> int:
+        while end < len(self.text) and ((c := self.text[end]) == "." or c.isdigit()):
+            end += 1
+        return end
+
     def read_var(self, first_char: str) -> Token:
-        buf = first_char
-        while self.has_input() and is_identifier_char(c := self.peek_char()):
-            self.read_char()
-            buf += c
-        return self.make_token(Name, buf)
+        start = self.idx - 1
+        end = IDENTIFIER_RE.match(self.text, self.idx).end()  # type: ignore[union-attr]
+        self.read_to(end)
+        # Programs repeat the same few names many times; interning makes the
+        # copies share one string and turns env lookups into pointer compares
+        return self.make_token(Name, sys.intern(self.text[start:end]))
 
     def read_bytes(self) -> Token:
-        buf = ""
-        while self.has_input():
-            if self.peek_char().isspace():
-                break
-            buf += self.read_char()
-        base, _, value = buf.rpartition("'")
-        return self.make_token(BytesLit, value, int(base) if base else 64)
+        start = self.idx
+        end = NON_SPACE_RE.match(self.text, start).end()  # type: ignore[union-attr]
+        self.read_to(end)
+        base, _, value = self.text[start:end].rpartition("'")
+        # Hand base64 the encoded bytes directly rather than a str it would
+        # have to encode itself
+        try:
+            encoded = value.encode("ascii")
+        except UnicodeEncodeError:
+            raise InvalidTokenError(self.current_token_source_extent)
+        return self.make_token(BytesLit, encoded, int(base) if base else 64)
 
 
 PEEK_EMPTY = object()
 
 
 class Peekable:
+    __slots__ = ("iterator", "cache")
+
     def __init__(self, iterator: Iterator[Any]) -> None:
         self.iterator = iterator
         self.cache = PEEK_EMPTY
@@ -352,16 +439,51 @@ class Peekable:
         return self
 
     def __next__(self) -> Any:
-        if self.cache is not PEEK_EMPTY:
-            result = self.cache
+        result = self.cache
+        if result is not PEEK_EMPTY:
             self.cache = PEEK_EMPTY
             return result
         return next(self.iterator)
 
     def peek(self) -> Any:
-        result = self.cache = next(self)
+        result = self.cache
+        if result is PEEK_EMPTY:
+            result = self.cache = next(self.iterator)
+        return result
+
+
+# Like Peekable, but over an already materialized list of tokens, so peeking
+# and advancing are plain list indexing. Running off the end raises
+# StopIteration just like Peekable does.
+class TokenCursor:
+    __slots__ = ("tokens", "pos")
+
+    def __init__(self, tokens: typing.List[Any]) -> None:
+        self.tokens = tokens
+        self.pos = 0
+
+    def __iter__(self) -> Iterator[Any]:
+        return self
+
+    def __next__(self) -> Any:
+        pos = self.pos
+        try:
+            result = self.tokens[pos]
+        except IndexError:
+            raise StopIteration
+        self.pos = pos + 1
         return result
 
+    def peek(self) -> Any:
+        try:
+            return self.tokens[self.pos]
+        except IndexError:
+            raise StopIteration
+
+
+# What the parser reads tokens from
+TokenStream = Union[Peekable, TokenCursor]
+
 
 class PeekableTests(unittest.TestCase):
     def test_can_create_peekable(self) -> None:
@@ -405,12 +527,94 @@ class PeekableTests(unittest.TestCase):
             next(empty)
 
 
-def tokenize(x: str) -> Peekable:
+class TokenCursorTests(unittest.TestCase):
+    def test_peek_next(self) -> None:
+        cursor = TokenCursor([1, 2])
+        self.assertEqual(cursor.peek(), 1)
+        self.assertEqual(next(cursor), 1)
+        self.assertEqual(cursor.peek(), 2)
+        self.assertEqual(next(cursor), 2)
+        with self.assertRaises(StopIteration):
+            cursor.peek()
+        with self.assertRaises(StopIteration):
+            next(cursor)
+
+    def test_can_iterate_over_cursor(self) -> None:
+        self.assertEqual(list(TokenCursor([1, 2, 3])), [1, 2, 3])
+
+
+def tokenize_ascii(text: str) -> Optional[typing.List[Token]]:
+    # Tokenize with a single regex, which is much faster than the Lexer. Only
+    # used for ASCII source, where byte offsets are string indices. Returns
+    # None on anything unusual, including every error, leaving it to the
+    # Lexer to tokenize (and report) precisely.
+    tokens: typing.List[Token] = []
+    match = TOKEN_RE.match
+    pos = 0
+    lineno = 1
+    line_start = 0
+    while pos < len(text):
+        m = match(text, pos)
+        if m is None:
+            return None
+        kind = m.lastgroup
+        end = m.end()
+        if kind == "space" or kind == "comment":
+            newlines = text.count("\n", pos, end)
+            if newlines:
+                lineno += newlines
+                line_start = text.rfind("\n", pos, end) + 1
+            pos = end
+            continue
+        value = m.group()
+        token: Token
+        if kind == "name":
+            token = Name(sys.intern(value))
+        elif kind == "op":
+            if value not in PS:
+                return None
+            token = Operator(value)
+        elif kind == "number":
+            if "." not in value:
+                token = IntLit(int(value))
+            elif value.count(".") == 1:
+                token = FloatLit(float(value))
+            else:
+                return None
+        elif kind == "string":
+            token = StringLit(value[1:-1])
+        elif kind == "bracket":
+            token = BRACKETS[value]()
+        elif kind == "hash":
+            token = Hash()
+        else:
+            assert kind == "bytes"
+            base, _, payload = value[2:].rpartition("'")
+            if base and not base.isdigit():
+                return None
+            token = BytesLit(payload.encode("ascii"), int(base) if base else 64)
+        # Like the Lexer, the end location is that of the last character
+        last = end - 1
+        start = (lineno, pos - line_start + 1, pos)
+        if kind == "string":
+            newlines = text.count("\n", pos, last)
+            if newlines:
+                lineno += newlines
+                line_start = text.rfind("\n", pos, last) + 1
+        token.location = start + (lineno, last - line_start + 1, last)
+        tokens.append(token)
+        pos = end
+    return tokens
+
+
+def tokenize(x: str) -> TokenCursor:
+    if x.isascii() and (tokens := tokenize_ascii(x)) is not None:
+        return TokenCursor(tokens)
     lexer = Lexer(x)
     tokens = []
     while (token := lexer.read_token()) and not isinstance(token, EOF):
         tokens.append(token)
-    return Peekable(iter(tokens))
+    return TokenCursor(tokens)
 
 
 @dataclass(frozen=True)
@@ -485,6 +689,62 @@ HIGHEST_PREC: float = max(max(p.pl, p.pr) for p in PS.values())
 
 OPER_CHARS = set("".join(PS.keys()))
 assert " " not in OPER_CHARS
+OPER_PREFIXES = frozenset(op[:i] for op in PS for i in range(1, len(op) + 1))
+
+
+BRACKETS: Dict[str, type] = {
+    "(": LeftParen,
+    ")": RightParen,
+    "{": LeftBrace,
+    "}": RightBrace,
+    "[": LeftBracket,
+    "]": RightBracket,
+}
+
+
+def _make_lexer_dispatch() -> typing.List[Callable[[Lexer, str], Token]]:
+    # One reader per ASCII character, so that Lexer.read_token can pick the
+    # reader for a token with a single index instead of a chain of tests.
+    # Later assignments take priority over earlier ones.
+    table: typing.List[Callable[[Lexer, str], Token]] = [Lexer.read_invalid] * 128
+    for byte in range(128):
+        c = chr(byte)
+        if is_identifier_char(c):
+            table[byte] = Lexer.read_var
+        elif c in OPER_CHARS:
+            table[byte] = Lexer.read_op
+    for c in BRACKETS:
+        table[ord(c)] = Lexer.read_bracket
+    for c in "0123456789":
+        table[ord(c)] = Lexer.read_number
+    table[ord('"')] = Lexer.read_quote
+    table[ord("-")] = Lexer.read_dash
+    table[ord("#")] = Lexer.read_hash
+    table[ord("~")] = Lexer.read_tilde
+    return table
+
+
+LEXER_DISPATCH = _make_lexer_dispatch()
+
+
+# One alternative per kind of token, in the same priority order as
+# LEXER_DISPATCH. Operators match the longest operator prefix, which is what
+# Lexer.read_op's greedy extension finds.
+TOKEN_RE = re.compile(
+    "|".join(
+        [
+            r"(?P<space>\s+)",
+            r"(?P<comment>--[^\n]*\n?)",
+            r'(?P<string>"[^"]*")',
+            r"(?P<number>[0-9][0-9.]*)",
+            r"(?P<name>[A-Za-z_$'][\w$']*)",
+            r"(?P<bracket>[()\[\]{}])",
+            r"(?P<hash>\#)",
+            r"(?P<bytes>~~\S*)",
+            "(?P<op>" + "|".join(re.escape(op) for op in sorted(OPER_PREFIXES, key=len, reverse=True)) + ")",
+        ]
+    )
+)
 
 
 class SyntacticError(Exception):
@@ -510,7 +770,7 @@ class UnexpectedEOFError(ParseError):
     pass
 
 
-def parse_assign(tokens: Peekable, p: float = 0) -> "Assign":
+def parse_assign(tokens: TokenStream, p: float = 0) -> "Assign":
     assign = parse_binary(tokens, p)
     if isinstance(assign, Spread):
         return Assign(Var("..."), assign)
@@ -531,121 +791,186 @@ def gensym_reset() -> None:
 gensym_reset()
 
 
-def parse_unary(tokens: Peekable, p: float) -> "Object":
-    token = next(tokens)
-    l: Object
-    if isinstance(token, IntLit):
-        return Int(token.value)
-    elif isinstance(token, FloatLit):
-        return Float(token.value)
-    elif isinstance(token, Name):
-        # TODO: Handle kebab case vars
-        return Var(token.value)
-    elif isinstance(token, Hash):
-        if isinstance(variant := next(tokens), Name):
-            # It needs to be higher than the precedence of the -> operator so that
-            # we can match variants in MatchFunction
-            # It needs to be higher than the precedence of the && operator so that
-            # we can use #true() and #false() in boolean expressions
-            # It needs to be higher than the precedence of juxtaposition so that
-            # f #true() #false() is parsed as f(TRUE)(FALSE)
-            return Variant(variant.value, parse_binary(tokens, PS[""].pr + 1))
-        else:
-            raise UnexpectedTokenError(variant)
-    elif isinstance(token, BytesLit):
-        base = token.base
-        if base == 85:
-            l = Bytes(base64.b85decode(token.value))
-        elif base == 64:
-            l = Bytes(base64.b64decode(token.value))
-        elif base == 32:
-            l = Bytes(base64.b32decode(token.value))
-        elif base == 16:
-            l = Bytes(base64.b16decode(token.value))
+def parse_int(token: Token, tokens: TokenStream) -> "Object":
+    assert isinstance(token, IntLit)
+    return int_node(token.value)
+
+
+def parse_float(token: Token, tokens: TokenStream) -> "Object":
+    assert isinstance(token, FloatLit)
+    return Float(token.value)
+
+
+def parse_name(token: Token, tokens: TokenStream) -> "Object":
+    assert isinstance(token, Name)
+    # TODO: Handle kebab case vars
+    return Var(token.value)
+
+
+def parse_variant(token: Token, tokens: TokenStream) -> "Object":
+    if isinstance(variant := next(tokens), Name):
+        # It needs to be higher than the precedence of the -> operator so that
+        # we can match variants in MatchFunction
+        # It needs to be higher than the precedence of the && operator so that
+        # we can use #true() and #false() in boolean expressions
+        # It needs to be higher than the precedence of juxtaposition so that
+        # f #true() #false() is parsed as f(TRUE)(FALSE)
+        return Variant(variant.value, parse_binary(tokens, PS[""].pr + 1))
+    else:
+        raise UnexpectedTokenError(variant)
+
+
+BYTES_DECODERS: Dict[int, Callable[[bytes], bytes]] = {
+    85: base64.b85decode,
+    # What b64decode calls after checking its argument type
+    64: binascii.a2b_base64,
+    32: base64.b32decode,
+    16: base64.b16decode,
+}
+
+
+def parse_bytes(token: Token, tokens: TokenStream) -> "Object":
+    assert isinstance(token, BytesLit)
+    decode = BYTES_DECODERS.get(token.base)
+    if decode is None:
+        raise ParseError(f"unexpected base {token.base!r} in {token!r}")
+    return Bytes(decode(token.value))
+
+
+def parse_string(token: Token, tokens: TokenStream) -> "Object":
+    assert isinstance(token, StringLit)
+    return String(token.value)
+
+
+def parse_spread(token: Token, tokens: TokenStream) -> "Object":
+    try:
+        if isinstance(tokens.peek(), Name):
+            return Spread(next(tokens).value)
         else:
-            raise ParseError(f"unexpected base {base!r} in {token!r}")
-        return l
-    elif isinstance(token, StringLit):
-        return String(token.value)
-    elif token == Operator("..."):
+            return Spread()
+    except StopIteration:
+        return Spread()
+
+
+def parse_match_function(token: Token, tokens: TokenStream) -> "Object":
+    expr = parse_binary(tokens, PS["|"].pr)  # TODO: make this work for larger arities
+    if not isinstance(expr, Function):
+        raise ParseError(f"expected function in match expression {expr!r}")
+    cases = [MatchCase(expr.arg, expr.body)]
+    while True:
         try:
-            if isinstance(tokens.peek(), Name):
-                return Spread(next(tokens).value)
-            else:
-                return Spread()
+            if tokens.peek() != Operator("|"):
+                break
         except StopIteration:
-            return Spread()
-    elif token == Operator("|"):
+            break
+        next(tokens)
         expr = parse_binary(tokens, PS["|"].pr)  # TODO: make this work for larger arities
         if not isinstance(expr, Function):
             raise ParseError(f"expected function in match expression {expr!r}")
-        cases = [MatchCase(expr.arg, expr.body)]
-        while True:
-            try:
-                if tokens.peek() != Operator("|"):
-                    break
-            except StopIteration:
-                break
-            next(tokens)
-            expr = parse_binary(tokens, PS["|"].pr)  # TODO: make this work for larger arities
-            if not isinstance(expr, Function):
-                raise ParseError(f"expected function in match expression {expr!r}")
-            cases.append(MatchCase(expr.arg, expr.body))
-        return MatchFunction(cases)
-    elif isinstance(token, LeftParen):
-        if isinstance(tokens.peek(), RightParen):
-            l = Hole()
-        else:
-            l = parse(tokens)
+        cases.append(MatchCase(expr.arg, expr.body))
+    return MatchFunction(cases)
+
+
+def parse_negate(token: Token, tokens: TokenStream) -> "Object":
+    # Unary minus
+    # Precedence was chosen to be higher than binary ops so that -a op
+    # b is (-a) op b and not -(a op b).
+    # Precedence was chosen to be higher than function application so that
+    # -a b is (-a) b and not -(a b).
+    r = parse_binary(tokens, HIGHEST_PREC + 1)
+    if isinstance(r, Int):
+        assert r.value >= 0, "Tokens should never have negative values"
+        return Int(-r.value)
+    if isinstance(r, Float):
+        assert r.value >= 0, "Tokens should never have negative values"
+        return Float(-r.value)
+    return Binop(BinopKind.SUB, int_node(0), r)
+
+
+def parse_prefix_operator(token: Token, tokens: TokenStream) -> "Object":
+    assert isinstance(token, Operator)
+    parser = PREFIX_OPERATOR_PARSERS.get(token.value)
+    if parser is None:
+        raise UnexpectedTokenError(token)
+    return parser(token, tokens)
+
+
+def parse_parens(token: Token, tokens: TokenStream) -> "Object":
+    l: Object
+    if isinstance(tokens.peek(), RightParen):
+        l = HOLE
+    else:
+        l = parse(tokens)
+    next(tokens)
+    return l
+
+
+def parse_list(token: Token, tokens: TokenStream) -> "Object":
+    l = List([])
+    token = tokens.peek()
+    if isinstance(token, RightBracket):
         next(tokens)
-        return l
-    elif isinstance(token, LeftBracket):
-        l = List([])
-        token = tokens.peek()
-        if isinstance(token, RightBracket):
-            next(tokens)
-        else:
+    else:
+        l.items.append(parse_binary(tokens, 2))
+        while not isinstance(next(tokens), RightBracket):
+            if isinstance(l.items[-1], Spread):
+                raise ParseError("spread must come at end of list match")
+            # TODO: Implement .. operator
             l.items.append(parse_binary(tokens, 2))
-            while not isinstance(next(tokens), RightBracket):
-                if isinstance(l.items[-1], Spread):
-                    raise ParseError("spread must come at end of list match")
-                # TODO: Implement .. operator
-                l.items.append(parse_binary(tokens, 2))
-        return l
-    elif isinstance(token, LeftBrace):
-        l = Record({})
-        token = tokens.peek()
-        if isinstance(token, RightBrace):
-            next(tokens)
-        else:
+    return l
+
+
+def parse_record(token: Token, tokens: TokenStream) -> "Object":
+    l = Record({})
+    token = tokens.peek()
+    if isinstance(token, RightBrace):
+        next(tokens)
+    else:
+        assign = parse_assign(tokens, 2)
+        l.data[assign.name.name] = assign.value
+        while not isinstance(next(tokens), RightBrace):
+            if isinstance(assign.value, Spread):
+                raise ParseError("spread must come at end of record match")
+            # TODO: Implement .. operator
             assign = parse_assign(tokens, 2)
             l.data[assign.name.name] = assign.value
-            while not isinstance(next(tokens), RightBrace):
-                if isinstance(assign.value, Spread):
-                    raise ParseError("spread must come at end of record match")
-                # TODO: Implement .. operator
-                assign = parse_assign(tokens, 2)
-                l.data[assign.name.name] = assign.value
-        return l
-    elif token == Operator("-"):
-        # Unary minus
-        # Precedence was chosen to be higher than binary ops so that -a op
-        # b is (-a) op b and not -(a op b).
-        # Precedence was chosen to be higher than function application so that
-        # -a b is (-a) b and not -(a b).
-        r = parse_binary(tokens, HIGHEST_PREC + 1)
-        if isinstance(r, Int):
-            assert r.value >= 0, "Tokens should never have negative values"
-            return Int(-r.value)
-        if isinstance(r, Float):
-            assert r.value >= 0, "Tokens should never have negative values"
-            return Float(-r.value)
-        return Binop(BinopKind.SUB, Int(0), r)
-    else:
+    return l
+
+
+TokenParser = Callable[[Token, TokenStream], "Object"]
+PREFIX_OPERATOR_PARSERS: Dict[str, TokenParser] = {
+    "...": parse_spread,
+    "|": parse_match_function,
+    "-": parse_negate,
+}
+# How parse_unary handles each kind of token, so that it dispatches with one
+# lookup on the token's type instead of a chain of isinstance checks
+UNARY_PARSERS: Dict[type, TokenParser] = {
+    IntLit: parse_int,
+    FloatLit: parse_float,
+    Name: parse_name,
+    Hash: parse_variant,
+    BytesLit: parse_bytes,
+    StringLit: parse_string,
+    Operator: parse_prefix_operator,
+    LeftParen: parse_parens,
+    LeftBracket: parse_list,
+    LeftBrace: parse_record,
+}
+
+
+CLOSING_BRACKETS = frozenset((RightParen, RightBracket, RightBrace))
+
+
+def parse_unary(tokens: TokenStream, p: float) -> "Object":
+    token = next(tokens)
+    parser = UNARY_PARSERS.get(type(token))
+    if parser is None:
         raise UnexpectedTokenError(token)
+    return parser(token, tokens)
 
 
-def parse_binary(tokens: Peekable, p: float) -> "Object":
+def parse_binary(tokens: TokenStream, p: float) -> "Object":
     l: Object = parse_unary(tokens, p)
     while True:
         op: Token
@@ -653,52 +978,29 @@ def parse_binary(tokens: Peekable, p: float) -> "Object":
             op = tokens.peek()
         except StopIteration:
             break
-        if isinstance(op, (RightParen, RightBracket, RightBrace)):
+        kind = type(op)
+        if kind in CLOSING_BRACKETS:
             break
-        if not isinstance(op, Operator):
+        if kind is not Operator:
             prec = PS[""]
             pl, pr = prec.pl, prec.pr
             if pl < p:
                 break
             l = Apply(l, parse_binary(tokens, pr))
             continue
+        assert isinstance(op, Operator)
         prec = PS[op.value]
         pl, pr = prec.pl, prec.pr
         if pl < p:
             break
         next(tokens)
-        if op == Operator("="):
-            if not isinstance(l, Var):
-                raise ParseError(f"expected variable in assignment {l!r}")
-            l = Assign(l, parse_binary(tokens, pr))
-        elif op == Operator("->"):
-            l = Function(l, parse_binary(tokens, pr))
-        elif op == Operator("|>"):
-            l = Apply(parse_binary(tokens, pr), l)
-        elif op == Operator("<|"):
-            l = Apply(l, parse_binary(tokens, pr))
-        elif op == Operator(">>"):
-            r = parse_binary(tokens, pr)
-            varname = gensym()
-            l = Function(Var(varname), Apply(r, Apply(l, Var(varname))))
-        elif op == Operator("<<"):
-            r = parse_binary(tokens, pr)
-            varname = gensym()
-            l = Function(Var(varname), Apply(l, Apply(r, Var(varname))))
-        elif op == Operator("."):
-            l = Where(l, parse_binary(tokens, pr))
-        elif op == Operator("?"):
-            l = Assert(l, parse_binary(tokens, pr))
-        elif op == Operator("@"):
-            # TODO: revisit whether to use @ or . for field access
-            l = Access(l, parse_binary(tokens, pr))
-        else:
-            assert isinstance(op, Operator)
-            l = Binop(BinopKind.from_str(op.value), l, parse_binary(tokens, pr))
+        if op.value == "=" and not isinstance(l, Var):
+            raise ParseError(f"expected variable in assignment {l!r}")
+        l = OPERATOR_BUILDERS[op.value](l, parse_binary(tokens, pr))
     return l
 
 
-def parse(tokens: Peekable) -> "Object":
+def parse(tokens: TokenStream) -> "Object":
     try:
         return parse_binary(tokens, 0)
     except StopIteration:
@@ -707,49 +1009,82 @@ def parse(tokens: Peekable) -> "Object":
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Object:
+    # Every node gets a slot for the type that infer_type records on it
+    __slots__ = ("inferred_type",)
+
     def __str__(self) -> str:
         return pretty(self)
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Int(Object):
+    __slots__ = ("value",)
+
     value: int
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Float(Object):
+    __slots__ = ("value",)
+
     value: float
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class String(Object):
+    __slots__ = ("value",)
+
     value: str
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Bytes(Object):
+    __slots__ = ("value",)
+
     value: bytes
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Var(Object):
+    __slots__ = ("name",)
+
     name: str
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Hole(Object):
-    pass
+    __slots__ = ()
 
 
+# Not slotted: a slot cannot coexist with the class-level default for name
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Spread(Object):
     name: Optional[str] = None
 
 
+# Literal nodes that the parser shares between all of their occurrences.
+# This is safe because type inference records the same constant type on
+# every Int and Hole; Var and Spread nodes get a fresh type variable per
+# occurrence and must never be shared.
+SMALL_INT_MIN = -128
+SMALL_INT_MAX = 1024
+SMALL_INT_NODES = tuple(Int(value) for value in range(SMALL_INT_MIN, SMALL_INT_MAX + 1))
+HOLE = Hole()
+
+
+def int_node(value: int) -> Int:
+    if SMALL_INT_MIN <= value <= SMALL_INT_MAX:
+        return SMALL_INT_NODES[value - SMALL_INT_MIN]
+    return Int(value)
+
+
 Env = Mapping[str, Object]
 
 
-class BinopKind(enum.Enum):
+class BinopKind(enum.IntEnum):
+    # An IntEnum so that members hash and compare as plain ints: a plain
+    # Enum hashes through a Python-level __hash__ on every dispatch-table
+    # lookup
     ADD = auto()
     SUB = auto()
     MUL = auto()
@@ -773,62 +1108,50 @@ class BinopKind(enum.Enum):
     PIPE = auto()
     REVERSE_PIPE = auto()
 
+    def __str__(self) -> str:
+        # Keep the Enum spelling rather than IntEnum's bare number
+        return f"{type(self).__name__}.{self.name}"
+
     @classmethod
     def from_str(cls, x: str) -> "BinopKind":
-        return {
-            "+": cls.ADD,
-            "-": cls.SUB,
-            "*": cls.MUL,
-            "/": cls.DIV,
-            "//": cls.FLOOR_DIV,
-            "^": cls.EXP,
-            "%": cls.MOD,
-            "==": cls.EQUAL,
-            "/=": cls.NOT_EQUAL,
-            "<": cls.LESS,
-            ">": cls.GREATER,
-            "<=": cls.LESS_EQUAL,
-            ">=": cls.GREATER_EQUAL,
-            "&&": cls.BOOL_AND,
-            "||": cls.BOOL_OR,
-            "++": cls.STRING_CONCAT,
-            ">+": cls.LIST_CONS,
-            "+<": cls.LIST_APPEND,
-            "!": cls.RIGHT_EVAL,
-            ":": cls.HASTYPE,
-            "|>": cls.PIPE,
-            "<|": cls.REVERSE_PIPE,
-        }[x]
+        return BINOP_FROM_STR[x]
 
     @classmethod
     def to_str(cls, binop_kind: "BinopKind") -> str:
-        return {
-            cls.ADD: "+",
-            cls.SUB: "-",
-            cls.MUL: "*",
-            cls.DIV: "/",
-            cls.EXP: "^",
-            cls.MOD: "%",
-            cls.EQUAL: "==",
-            cls.NOT_EQUAL: "/=",
-            cls.LESS: "<",
-            cls.GREATER: ">",
-            cls.LESS_EQUAL: "<=",
-            cls.GREATER_EQUAL: ">=",
-            cls.BOOL_AND: "&&",
-            cls.BOOL_OR: "||",
-            cls.STRING_CONCAT: "++",
-            cls.LIST_CONS: ">+",
-            cls.LIST_APPEND: "+<",
-            cls.RIGHT_EVAL: "!",
-            cls.HASTYPE: ":",
-            cls.PIPE: "|>",
-            cls.REVERSE_PIPE: "<|",
-        }[binop_kind]
+        return BINOP_TO_STR[binop_kind]
+
+
+BINOP_FROM_STR = {
+    "+": BinopKind.ADD,
+    "-": BinopKind.SUB,
+    "*": BinopKind.MUL,
+    "/": BinopKind.DIV,
+    "//": BinopKind.FLOOR_DIV,
+    "^": BinopKind.EXP,
+    "%": BinopKind.MOD,
+    "==": BinopKind.EQUAL,
+    "/=": BinopKind.NOT_EQUAL,
+    "<": BinopKind.LESS,
+    ">": BinopKind.GREATER,
+    "<=": BinopKind.LESS_EQUAL,
+    ">=": BinopKind.GREATER_EQUAL,
+    "&&": BinopKind.BOOL_AND,
+    "||": BinopKind.BOOL_OR,
+    "++": BinopKind.STRING_CONCAT,
+    ">+": BinopKind.LIST_CONS,
+    "+<": BinopKind.LIST_APPEND,
+    "!": BinopKind.RIGHT_EVAL,
+    ":": BinopKind.HASTYPE,
+    "|>": BinopKind.PIPE,
+    "<|": BinopKind.REVERSE_PIPE,
+}
+BINOP_TO_STR = {kind: op for op, kind in BINOP_FROM_STR.items()}
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Binop(Object):
+    __slots__ = ("op", "left", "right")
+
     op: BinopKind
     left: Object
     right: Object
@@ -836,41 +1159,56 @@ class Binop(Object):
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class List(Object):
+    __slots__ = ("items",)
+
     items: typing.List[Object]
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Assign(Object):
+    __slots__ = ("name", "value")
+
     name: Var
     value: Object
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Function(Object):
+    # free_vars caches free_in(self); function bodies do not change once built
+    __slots__ = ("arg", "body", "free_vars")
+
     arg: Object
     body: Object
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Apply(Object):
+    __slots__ = ("func", "arg")
+
     func: Object
     arg: Object
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Where(Object):
+    __slots__ = ("body", "binding")
+
     body: Object
     binding: Object
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Assert(Object):
+    __slots__ = ("value", "cond")
+
     value: Object
     cond: Object
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class EnvObject(Object):
+    __slots__ = ("env",)
+
     env: Env
 
     def __str__(self) -> str:
@@ -879,54 +1217,106 @@ class EnvObject(Object):
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class MatchCase(Object):
+    __slots__ = ("pattern", "body")
+
     pattern: Object
     body: Object
 
 
+# Not slotted: a slot cannot coexist with the class-level field() for
+# match_table. free_vars caches free_in(self), as for Function; match_table
+# holds build_match_table(self.cases), computed once up front.
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class MatchFunction(Object):
     cases: typing.List[MatchCase]
+    match_table: Optional[MatchTable] = dataclasses.field(init=False, repr=False, compare=False, hash=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "match_table", build_match_table(self.cases))
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Relocation(Object):
+    __slots__ = ("name",)
+
     name: str
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class NativeFunctionRelocation(Relocation):
-    pass
+    __slots__ = ()
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class NativeFunction(Object):
+    __slots__ = ("name", "func")
+
     name: str
     func: Callable[[Object], Object]
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Closure(Object):
+    __slots__ = ("env", "func")
+
     env: Env
     func: Union[Function, MatchFunction]
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Record(Object):
+    __slots__ = ("data",)
+
     data: Dict[str, Object]
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Access(Object):
+    __slots__ = ("obj", "at")
+
     obj: Object
     at: Object
 
 
 @dataclass(eq=True, frozen=True, unsafe_hash=True)
 class Variant(Object):
+    __slots__ = ("tag", "value")
+
     tag: str
     value: Object
 
 
+def _compose_right(l: Object, r: Object) -> Object:
+    varname = gensym()
+    return Function(Var(varname), Apply(r, Apply(l, Var(varname))))
+
+
+def _compose_left(l: Object, r: Object) -> Object:
+    varname = gensym()
+    return Function(Var(varname), Apply(l, Apply(r, Var(varname))))
+
+
+# How parse_binary combines the operands of each operator; everything else
+# is a plain Binop
+OPERATOR_BUILDERS: Dict[str, Callable[[Object, Object], Object]] = {
+    op: functools.partial(Binop, kind) for op, kind in BINOP_FROM_STR.items()
+}
+OPERATOR_BUILDERS.update(
+    {
+        "=": lambda l, r: Assign(typing.cast(Var, l), r),
+        "->": Function,
+        "|>": lambda l, r: Apply(r, l),
+        "<|": Apply,
+        ">>": _compose_right,
+        "<<": _compose_left,
+        ".": Where,
+        "?": Assert,
+        # TODO: revisit whether to use @ or . for field access
+        "@": Access,
+    }
+)
+
+
 tags = [
     TYPE_SHORT := b"i",  # fits in 64 bits
     TYPE_LONG := b"l",  # bignum
@@ -949,6 +1339,7 @@ tags = [
     TYPE_ACCESS := b"@",
     TYPE_SPREAD := b"S",
     TYPE_NAMED_SPREAD := b"R",
+    TYPE_FLOAT_LIST := b"D",  # list of only floats, packed
 ]
 FLAG_REF = 0x80
 
@@ -956,7 +1347,6 @@ FLAG_REF = 0x80
 BITS_PER_BYTE = 8
 BYTES_PER_DIGIT = 8
 BITS_PER_DIGIT = BYTES_PER_DIGIT * BITS_PER_BYTE
-DIGIT_MASK = (1 << BITS_PER_DIGIT) - 1
 
 
 def ref(tag: bytes) -> bytes:
@@ -981,16 +1371,31 @@ def zigzag_decode(val: int) -> int:
     return val // 2
 
 
+# Deserialized String literals up to this many characters are interned
+SHORT_STRING_LENGTH = 32
+
+# Precompiled so float serde does not re-parse the format on every call
+FLOAT64 = struct.Struct("<d")
+
+# The one-byte varint encodings of -64..63, indexed by value + 64
+SMALL_VARINTS = tuple(bytes([zigzag_encode(val)]) for val in range(-64, 64))
+# Decoded value of every single-byte varint, indexed by the byte itself
+SMALL_VARINT_VALUES = tuple(zigzag_decode(byte) for byte in range(0x80))
+
+
 @dataclass
 class Serializer:
     refs: typing.List[Object] = dataclasses.field(default_factory=list)
     output: bytearray = dataclasses.field(default_factory=bytearray)
+    # Maps id(obj) to its index in refs; refs keeps the objects alive so the
+    # ids stay unique
+    ref_index: Dict[int, int] = dataclasses.field(default_factory=dict, init=False, repr=False, compare=False)
+    # ids of the Lists and Closures reachable more than once from the object
+    # being serialized; only these are worth a ref slot
+    shared: Set[int] = dataclasses.field(default_factory=set, init=False, repr=False, compare=False)
 
     def ref(self, obj: Object) -> Optional[int]:
-        for idx, ref in enumerate(self.refs):
-            if ref is obj:
-                return idx
-        return None
+        return self.ref_index.get(id(obj))
 
     def add_ref(self, ty: bytes, obj: Object) -> int:
         assert len(ty) == 1
@@ -998,6 +1403,7 @@ class Serializer:
         self.emit(ref(ty))
         result = len(self.refs)
         self.refs.append(obj)
+        self.ref_index[id(obj)] = result
         return result
 
     def emit(self, obj: bytes) -> None:
@@ -1006,136 +1412,228 @@ class Serializer:
     def _fits_in_nbits(self, obj: int, nbits: int) -> bool:
         return -(1 << (nbits - 1)) <= obj < (1 << (nbits - 1))
 
-    def _short(self, number: int) -> bytes:
+    def _emit_short(self, number: int) -> None:
+        if -64 <= number < 64:
+            # Lengths, refs, and most ints fit in a single varint byte
+            self.output.extend(SMALL_VARINTS[number + 64])
+            return
         # From Peter Ruibal, https://github.com/fmoo/python-varint
         number = zigzag_encode(number)
-        buf = bytearray()
+        output = self.output
         while True:
             towrite = number & 0x7F
             number >>= 7
             if number:
-                buf.append(towrite | 0x80)
+                output.append(towrite | 0x80)
             else:
-                buf.append(towrite)
+                output.append(towrite)
                 break
-        return bytes(buf)
 
-    def _long(self, number: int) -> bytes:
-        digits = []
+    def _emit_long(self, number: int) -> None:
+        # Little-endian digits, so the whole number can be written at once
         number = zigzag_encode(number)
-        while number:
-            digits.append(number & DIGIT_MASK)
-            number >>= BITS_PER_DIGIT
-        buf = bytearray(self._short(len(digits)))
-        for digit in digits:
-            buf.extend(digit.to_bytes(BYTES_PER_DIGIT, "little"))
-        return bytes(buf)
-
-    def _string(self, obj: str) -> bytes:
+        num_digits = (number.bit_length() + BITS_PER_DIGIT - 1) // BITS_PER_DIGIT
+        self._emit_short(num_digits)
+        self.emit(number.to_bytes(num_digits * BYTES_PER_DIGIT, "little"))
+
+    def _emit_string(self, obj: str) -> None:
         encoded = obj.encode("utf-8")
-        return self._short(len(encoded)) + encoded
+        self._emit_short(len(encoded))
+        self.emit(encoded)
+
+    def _find_shared(self, root: Object) -> Set[int]:
+        seen: Set[int] = set()
+        shared: Set[int] = set()
+        stack = [root]
+        while stack:
+            obj = stack.pop()
+            if isinstance(obj, (List, Closure)):
+                if id(obj) in seen:
+                    shared.add(id(obj))
+                    continue
+                seen.add(id(obj))
+            if isinstance(obj, List):
+                stack.extend(obj.items)
+            elif isinstance(obj, Closure):
+                stack.append(obj.func)
+                stack.extend(obj.env.values())
+            elif isinstance(obj, Record):
+                stack.extend(obj.data.values())
+            elif isinstance(obj, Variant):
+                stack.append(obj.value)
+            elif isinstance(obj, Function):
+                stack += (obj.arg, obj.body)
+            elif isinstance(obj, MatchFunction):
+                for case in obj.cases:
+                    stack += (case.pattern, case.body)
+            elif isinstance(obj, Assign):
+                stack += (obj.name, obj.value)
+            elif isinstance(obj, Binop):
+                stack += (obj.left, obj.right)
+            elif isinstance(obj, Apply):
+                stack += (obj.func, obj.arg)
+            elif isinstance(obj, Where):
+                stack += (obj.body, obj.binding)
+            elif isinstance(obj, Access):
+                stack += (obj.obj, obj.at)
+        return shared
+
+    def _add_ref_if_shared(self, ty: bytes, obj: Object) -> None:
+        if id(obj) in self.shared:
+            self.add_ref(ty, obj)
+        else:
+            self.emit(ty)
 
     def serialize(self, obj: Object) -> None:
+        # Objects referenced only once are written inline without a ref
+        # slot, which keeps both the output and the reader's refs short
+        self.shared = self._find_shared(obj)
+        self._serialize(obj)
+
+    def _serialize(self, obj: Object) -> None:
         assert isinstance(obj, Object), type(obj)
         if (ref := self.ref(obj)) is not None:
-            return self.emit(TYPE_REF + self._short(ref))
-        if isinstance(obj, Int):
-            if self._fits_in_nbits(obj.value, 64):
-                self.emit(TYPE_SHORT)
-                self.emit(self._short(obj.value))
-                return
-            self.emit(TYPE_LONG)
-            self.emit(self._long(obj.value))
-            return
-        if isinstance(obj, String):
-            return self.emit(TYPE_STRING + self._string(obj.value))
-        if isinstance(obj, List):
-            self.add_ref(TYPE_LIST, obj)
-            self.emit(self._short(len(obj.items)))
-            for item in obj.items:
-                self.serialize(item)
-            return
-        if isinstance(obj, Variant):
-            # TODO(max): Determine if this should be a ref
-            self.emit(TYPE_VARIANT)
-            # TODO(max): String pool (via refs) for strings longer than some length?
-            self.emit(self._string(obj.tag))
-            return self.serialize(obj.value)
-        if isinstance(obj, Record):
-            # TODO(max): Determine if this should be a ref
-            self.emit(TYPE_RECORD)
-            self.emit(self._short(len(obj.data)))
-            for key, value in obj.data.items():
-                self.emit(self._string(key))
-                self.serialize(value)
-            return
-        if isinstance(obj, Var):
-            return self.emit(TYPE_VAR + self._string(obj.name))
-        if isinstance(obj, Function):
-            self.emit(TYPE_FUNCTION)
-            self.serialize(obj.arg)
-            return self.serialize(obj.body)
-        if isinstance(obj, MatchFunction):
-            self.emit(TYPE_MATCH_FUNCTION)
-            self.emit(self._short(len(obj.cases)))
-            for case in obj.cases:
-                self.serialize(case.pattern)
-                self.serialize(case.body)
-            return
-        if isinstance(obj, Closure):
-            self.add_ref(TYPE_CLOSURE, obj)
-            self.serialize(obj.func)
-            self.emit(self._short(len(obj.env)))
-            for key, value in obj.env.items():
-                self.emit(self._string(key))
-                self.serialize(value)
+            self.emit(TYPE_REF)
+            return self._emit_short(ref)
+        serializer = SERIALIZERS.get(type(obj))
+        if serializer is None:
+            raise NotImplementedError(type(obj))
+        serializer(self, obj)
+
+    def _serialize_int(self, obj: Int) -> None:
+        if self._fits_in_nbits(obj.value, 64):
+            self.emit(TYPE_SHORT)
+            self._emit_short(obj.value)
             return
-        if isinstance(obj, Bytes):
-            self.emit(TYPE_BYTES)
-            self.emit(self._short(len(obj.value)))
-            self.emit(obj.value)
-            return
-        if isinstance(obj, Float):
-            self.emit(TYPE_FLOAT)
-            self.emit(struct.pack("<d", obj.value))
-            return
-        if isinstance(obj, Hole):
-            self.emit(TYPE_HOLE)
-            return
-        if isinstance(obj, Assign):
-            self.emit(TYPE_ASSIGN)
-            self.serialize(obj.name)
-            self.serialize(obj.value)
-            return
-        if isinstance(obj, Binop):
-            self.emit(TYPE_BINOP)
-            self.emit(self._string(BinopKind.to_str(obj.op)))
-            self.serialize(obj.left)
-            self.serialize(obj.right)
-            return
-        if isinstance(obj, Apply):
-            self.emit(TYPE_APPLY)
-            self.serialize(obj.func)
-            self.serialize(obj.arg)
-            return
-        if isinstance(obj, Where):
-            self.emit(TYPE_WHERE)
-            self.serialize(obj.body)
-            self.serialize(obj.binding)
-            return
-        if isinstance(obj, Access):
-            self.emit(TYPE_ACCESS)
-            self.serialize(obj.obj)
-            self.serialize(obj.at)
-            return
-        if isinstance(obj, Spread):
-            if obj.name is not None:
-                self.emit(TYPE_NAMED_SPREAD)
-                self.emit(self._string(obj.name))
+        self.emit(TYPE_LONG)
+        self._emit_long(obj.value)
+
+    def _serialize_string(self, obj: String) -> None:
+        self.emit(TYPE_STRING)
+        self._emit_string(obj.value)
+
+    def _serialize_list(self, obj: List) -> None:
+        items = obj.items
+        if items and isinstance(items[0], Float):
+            floats = [item.value for item in items if isinstance(item, Float)]
+            if len(floats) == len(items):
+                # Pack all the doubles in one go instead of tagging each one
+                self._add_ref_if_shared(TYPE_FLOAT_LIST, obj)
+                self._emit_short(len(floats))
+                self.emit(struct.pack(f"<{len(floats)}d", *floats))
                 return
-            self.emit(TYPE_SPREAD)
+        self._add_ref_if_shared(TYPE_LIST, obj)
+        self._emit_short(len(obj.items))
+        for item in obj.items:
+            self._serialize(item)
+
+    def _serialize_variant(self, obj: Variant) -> None:
+        # TODO(max): Determine if this should be a ref
+        self.emit(TYPE_VARIANT)
+        # TODO(max): String pool (via refs) for strings longer than some length?
+        self._emit_string(obj.tag)
+        self._serialize(obj.value)
+
+    def _serialize_record(self, obj: Record) -> None:
+        # TODO(max): Determine if this should be a ref
+        self.emit(TYPE_RECORD)
+        self._emit_short(len(obj.data))
+        for key, value in obj.data.items():
+            self._emit_string(key)
+            self._serialize(value)
+
+    def _serialize_var(self, obj: Var) -> None:
+        self.emit(TYPE_VAR)
+        self._emit_string(obj.name)
+
+    def _serialize_function(self, obj: Function) -> None:
+        self.emit(TYPE_FUNCTION)
+        self._serialize(obj.arg)
+        self._serialize(obj.body)
+
+    def _serialize_match_function(self, obj: MatchFunction) -> None:
+        self.emit(TYPE_MATCH_FUNCTION)
+        self._emit_short(len(obj.cases))
+        for case in obj.cases:
+            self._serialize(case.pattern)
+            self._serialize(case.body)
+
+    def _serialize_closure(self, obj: Closure) -> None:
+        self._add_ref_if_shared(TYPE_CLOSURE, obj)
+        self._serialize(obj.func)
+        self._emit_short(len(obj.env))
+        for key, value in obj.env.items():
+            self._emit_string(key)
+            self._serialize(value)
+
+    def _serialize_bytes(self, obj: Bytes) -> None:
+        self.emit(TYPE_BYTES)
+        self._emit_short(len(obj.value))
+        self.emit(obj.value)
+
+    def _serialize_float(self, obj: Float) -> None:
+        self.emit(TYPE_FLOAT)
+        self.emit(FLOAT64.pack(obj.value))
+
+    def _serialize_hole(self, obj: Hole) -> None:
+        self.emit(TYPE_HOLE)
+
+    def _serialize_assign(self, obj: Assign) -> None:
+        self.emit(TYPE_ASSIGN)
+        self._serialize(obj.name)
+        self._serialize(obj.value)
+
+    def _serialize_binop(self, obj: Binop) -> None:
+        self.emit(TYPE_BINOP)
+        self._emit_string(BinopKind.to_str(obj.op))
+        self._serialize(obj.left)
+        self._serialize(obj.right)
+
+    def _serialize_apply(self, obj: Apply) -> None:
+        self.emit(TYPE_APPLY)
+        self._serialize(obj.func)
+        self._serialize(obj.arg)
+
+    def _serialize_where(self, obj: Where) -> None:
+        self.emit(TYPE_WHERE)
+        self._serialize(obj.body)
+        self._serialize(obj.binding)
+
+    def _serialize_access(self, obj: Access) -> None:
+        self.emit(TYPE_ACCESS)
+        self._serialize(obj.obj)
+        self._serialize(obj.at)
+
+    def _serialize_spread(self, obj: Spread) -> None:
+        if obj.name is not None:
+            self.emit(TYPE_NAMED_SPREAD)
+            self._emit_string(obj.name)
             return
-        raise NotImplementedError(type(obj))
+        self.emit(TYPE_SPREAD)
+
+
+# One writer per node type, keyed on the exact type so Serializer.serialize
+# does a single lookup instead of walking an isinstance chain
+SERIALIZERS: Dict[type, Callable[[Serializer, Any], None]] = {
+    Int: Serializer._serialize_int,
+    String: Serializer._serialize_string,
+    List: Serializer._serialize_list,
+    Variant: Serializer._serialize_variant,
+    Record: Serializer._serialize_record,
+    Var: Serializer._serialize_var,
+    Function: Serializer._serialize_function,
+    MatchFunction: Serializer._serialize_match_function,
+    Closure: Serializer._serialize_closure,
+    Bytes: Serializer._serialize_bytes,
+    Float: Serializer._serialize_float,
+    Hole: Serializer._serialize_hole,
+    Assign: Serializer._serialize_assign,
+    Binop: Serializer._serialize_binop,
+    Apply: Serializer._serialize_apply,
+    Where: Serializer._serialize_where,
+    Access: Serializer._serialize_access,
+    Spread: Serializer._serialize_spread,
+}
 
 
 @dataclass
@@ -1149,158 +1647,224 @@ class Deserializer:
             self.flat = memoryview(self.flat)
 
     def read(self, size: int) -> memoryview:
-        result = memoryview(self.flat[self.idx : self.idx + size])
-        self.idx += size
-        return result
-
-    def read_tag(self) -> Tuple[bytes, bool]:
-        tag = self.read(1)[0]
-        is_ref = bool(tag & FLAG_REF)
-        return (tag & ~FLAG_REF).to_bytes(1, "little"), is_ref
+        # flat is always a memoryview by now, so slicing it shares the
+        # underlying buffer instead of copying or re-wrapping it
+        idx = self.idx
+        self.idx = idx + size
+        return self.flat[idx : idx + size]  # type: ignore[return-value]
+
+    def read_tag(self) -> Tuple[int, bool]:
+        idx = self.idx
+        tag = self.flat[idx]
+        self.idx = idx + 1
+        return tag & ~FLAG_REF, bool(tag & FLAG_REF)
 
     def _string(self) -> str:
         length = self._short()
         encoded = self.read(length)
         return str(encoded, "utf-8")
 
+    def _name(self) -> str:
+        # Record keys, closure env keys, variant tags and variable names
+        # repeat across a payload; interning them shares one string per name
+        # and lets dict lookups on them succeed on identity
+        return sys.intern(self._string())
+
     def _short(self) -> int:
+        flat = self.flat
+        idx = self.idx
+        i = flat[idx]
+        if i < 0x80:
+            # Lengths and small ints fit in a single byte; skip the loop.
+            self.idx = idx + 1
+            return SMALL_VARINT_VALUES[i]
         # From Peter Ruibal, https://github.com/fmoo/python-varint
         shift = 0
         result = 0
         while True:
-            i = self.read(1)[0]
+            i = flat[idx]
+            idx += 1
             result |= (i & 0x7F) << shift
             shift += 7
             if not (i & 0x80):
                 break
+        self.idx = idx
         return zigzag_decode(result)
 
     def _long(self) -> int:
         num_digits = self._short()
-        digits = []
-        for _ in range(num_digits):
-            digit = int.from_bytes(self.read(BYTES_PER_DIGIT), "little")
-            digits.append(digit)
-        result = 0
-        for digit in reversed(digits):
-            result <<= BITS_PER_DIGIT
-            result |= digit
-        return zigzag_decode(result)
+        return zigzag_decode(int.from_bytes(self.read(num_digits * BYTES_PER_DIGIT), "little"))
 
     def parse(self) -> Object:
         ty, is_ref = self.read_tag()
-        if ty == TYPE_REF:
-            idx = self._short()
-            return self.refs[idx]
-        if ty == TYPE_SHORT:
-            assert not is_ref
-            return Int(self._short())
-        if ty == TYPE_LONG:
-            assert not is_ref
-            return Int(self._long())
-        if ty == TYPE_STRING:
-            assert not is_ref
-            return String(self._string())
-        if ty == TYPE_LIST:
-            length = self._short()
-            result_list = List([])
-            assert is_ref
+        parser = DESERIALIZERS.get(ty)
+        if parser is None:
+            raise NotImplementedError(bytes([ty]))
+        return parser(self, is_ref)
+
+    def _parse_ref(self, is_ref: bool) -> Object:
+        idx = self._short()
+        return self.refs[idx]
+
+    def _parse_short(self, is_ref: bool) -> Object:
+        assert not is_ref
+        return int_node(self._short())
+
+    def _parse_long(self, is_ref: bool) -> Object:
+        assert not is_ref
+        return Int(self._long())
+
+    def _parse_string(self, is_ref: bool) -> Object:
+        assert not is_ref
+        value = self._string()
+        if len(value) <= SHORT_STRING_LENGTH:
+            # Short strings are mostly repeated literals like keys and labels
+            value = sys.intern(value)
+        return String(value)
+
+    def _parse_list(self, is_ref: bool) -> Object:
+        length = self._short()
+        result_list = List([])
+        if is_ref:
+            # The list has to be registered before its items are parsed so
+            # that they can refer back to it
             self.refs.append(result_list)
-            for i in range(length):
-                result_list.items.append(self.parse())
-            return result_list
-        if ty == TYPE_RECORD:
-            assert not is_ref
-            length = self._short()
-            result_rec = Record({})
-            for i in range(length):
-                key = self._string()
-                value = self.parse()
-                result_rec.data[key] = value
-            return result_rec
-        if ty == TYPE_VARIANT:
-            assert not is_ref
-            tag = self._string()
-            value = self.parse()
-            return Variant(tag, value)
-        if ty == TYPE_VAR:
-            assert not is_ref
-            return Var(self._string())
-        if ty == TYPE_FUNCTION:
-            assert not is_ref
-            arg = self.parse()
-            body = self.parse()
-            return Function(arg, body)
-        if ty == TYPE_MATCH_FUNCTION:
-            assert not is_ref
-            length = self._short()
-            result_matchfun = MatchFunction([])
-            for i in range(length):
-                pattern = self.parse()
-                body = self.parse()
-                result_matchfun.cases.append(MatchCase(pattern, body))
-            return result_matchfun
-        if ty == TYPE_CLOSURE:
-            func = self.parse()
-            length = self._short()
-            assert isinstance(func, (Function, MatchFunction))
-            result_closure = Closure({}, func)
-            assert is_ref
+        result_list.items.extend([self.parse() for _ in range(length)])
+        return result_list
+
+    def _parse_float_list(self, is_ref: bool) -> Object:
+        length = self._short()
+        idx = self.idx
+        self.idx = idx + 8 * length
+        result_list = List([Float(value) for value in struct.unpack_from(f"<{length}d", self.flat, idx)])
+        if is_ref:
+            self.refs.append(result_list)
+        return result_list
+
+    def _parse_record(self, is_ref: bool) -> Object:
+        assert not is_ref
+        length = self._short()
+        return Record({self._name(): self.parse() for _ in range(length)})
+
+    def _parse_variant(self, is_ref: bool) -> Object:
+        assert not is_ref
+        tag = self._name()
+        value = self.parse()
+        return Variant(tag, value)
+
+    def _parse_var(self, is_ref: bool) -> Object:
+        assert not is_ref
+        return Var(self._name())
+
+    def _parse_function(self, is_ref: bool) -> Object:
+        assert not is_ref
+        arg = self.parse()
+        body = self.parse()
+        return Function(arg, body)
+
+    def _parse_match_function(self, is_ref: bool) -> Object:
+        assert not is_ref
+        length = self._short()
+        return MatchFunction([MatchCase(self.parse(), self.parse()) for _ in range(length)])
+
+    def _parse_closure(self, is_ref: bool) -> Object:
+        func = self.parse()
+        length = self._short()
+        assert isinstance(func, (Function, MatchFunction))
+        result_closure = Closure({}, func)
+        if is_ref:
             self.refs.append(result_closure)
-            for i in range(length):
-                key = self._string()
-                value = self.parse()
-                assert isinstance(result_closure.env, dict)  # For mypy
-                result_closure.env[key] = value
-            return result_closure
-        if ty == TYPE_BYTES:
-            assert not is_ref
-            length = self._short()
-            return Bytes(self.read(length))
-        if ty == TYPE_FLOAT:
-            assert not is_ref
-            return Float(struct.unpack("<d", self.read(8))[0])
-        if ty == TYPE_HOLE:
-            assert not is_ref
-            return Hole()
-        if ty == TYPE_ASSIGN:
-            assert not is_ref
-            name = self.parse()
-            value = self.parse()
-            assert isinstance(name, Var)
-            return Assign(name, value)
-        if ty == TYPE_BINOP:
-            assert not is_ref
-            op = BinopKind.from_str(self._string())
-            left = self.parse()
-            right = self.parse()
-            return Binop(op, left, right)
-        if ty == TYPE_APPLY:
-            assert not is_ref
-            func = self.parse()
-            arg = self.parse()
-            return Apply(func, arg)
-        if ty == TYPE_WHERE:
-            assert not is_ref
-            body = self.parse()
-            binding = self.parse()
-            return Where(body, binding)
-        if ty == TYPE_ACCESS:
-            assert not is_ref
-            obj = self.parse()
-            at = self.parse()
-            return Access(obj, at)
-        if ty == TYPE_SPREAD:
-            return Spread()
-        if ty == TYPE_NAMED_SPREAD:
-            return Spread(self._string())
-        raise NotImplementedError(bytes(ty))
+        assert isinstance(result_closure.env, dict)  # For mypy
+        result_closure.env.update({self._name(): self.parse() for _ in range(length)})
+        return result_closure
+
+    def _parse_bytes(self, is_ref: bool) -> Object:
+        assert not is_ref
+        length = self._short()
+        return Bytes(self.read(length))
+
+    def _parse_float(self, is_ref: bool) -> Object:
+        assert not is_ref
+        idx = self.idx
+        self.idx = idx + 8
+        return Float(FLOAT64.unpack_from(self.flat, idx)[0])
+
+    def _parse_hole(self, is_ref: bool) -> Object:
+        assert not is_ref
+        return HOLE
+
+    def _parse_assign(self, is_ref: bool) -> Object:
+        assert not is_ref
+        name = self.parse()
+        value = self.parse()
+        assert isinstance(name, Var)
+        return Assign(name, value)
+
+    def _parse_binop(self, is_ref: bool) -> Object:
+        assert not is_ref
+        op = BinopKind.from_str(self._string())
+        left = self.parse()
+        right = self.parse()
+        return Binop(op, left, right)
+
+    def _parse_apply(self, is_ref: bool) -> Object:
+        assert not is_ref
+        func = self.parse()
+        arg = self.parse()
+        return Apply(func, arg)
+
+    def _parse_where(self, is_ref: bool) -> Object:
+        assert not is_ref
+        body = self.parse()
+        binding = self.parse()
+        return Where(body, binding)
+
+    def _parse_access(self, is_ref: bool) -> Object:
+        assert not is_ref
+        obj = self.parse()
+        at = self.parse()
+        return Access(obj, at)
+
+    def _parse_spread(self, is_ref: bool) -> Object:
+        return Spread()
+
+    def _parse_named_spread(self, is_ref: bool) -> Object:
+        return Spread(self._name())
+
+
+# One reader per tag, so that Deserializer.parse dispatches with a single
+# lookup instead of comparing the tag against every type in turn. Keyed on
+# the tag's byte value so read_tag never has to build a bytes object.
+DESERIALIZERS: Dict[int, Callable[[Deserializer, bool], Object]] = {
+    TYPE_REF[0]: Deserializer._parse_ref,
+    TYPE_SHORT[0]: Deserializer._parse_short,
+    TYPE_LONG[0]: Deserializer._parse_long,
+    TYPE_STRING[0]: Deserializer._parse_string,
+    TYPE_LIST[0]: Deserializer._parse_list,
+    TYPE_RECORD[0]: Deserializer._parse_record,
+    TYPE_VARIANT[0]: Deserializer._parse_variant,
+    TYPE_VAR[0]: Deserializer._parse_var,
+    TYPE_FUNCTION[0]: Deserializer._parse_function,
+    TYPE_MATCH_FUNCTION[0]: Deserializer._parse_match_function,
+    TYPE_CLOSURE[0]: Deserializer._parse_closure,
+    TYPE_BYTES[0]: Deserializer._parse_bytes,
+    TYPE_FLOAT[0]: Deserializer._parse_float,
+    TYPE_HOLE[0]: Deserializer._parse_hole,
+    TYPE_ASSIGN[0]: Deserializer._parse_assign,
+    TYPE_BINOP[0]: Deserializer._parse_binop,
+    TYPE_APPLY[0]: Deserializer._parse_apply,
+    TYPE_WHERE[0]: Deserializer._parse_where,
+    TYPE_ACCESS[0]: Deserializer._parse_access,
+    TYPE_SPREAD[0]: Deserializer._parse_spread,
+    TYPE_NAMED_SPREAD[0]: Deserializer._parse_named_spread,
+    TYPE_FLOAT_LIST[0]: Deserializer._parse_float_list,
+}
 
 
-TRUE = Variant("true", Hole())
+TRUE = Variant("true", HOLE)
 
 
-FALSE = Variant("false", Hole())
+FALSE = Variant("false", HOLE)
 
 
 def unpack_number(obj: Object) -> Union[int, float]:
@@ -1347,7 +1911,7 @@ def wrap_inferred_number_type(x: Union[int, float]) -> Object:
     # arithmetic operations, type inference, and multiple dispatch.
     # Update this to make the interpreter more language agnostic.
     if isinstance(x, int):
-        return Int(x)
+        return int_node(x)
     return Float(x)
 
 
@@ -1378,103 +1942,200 @@ class MatchError(Exception):
     pass
 
 
-def match(obj: Object, pattern: Object) -> Optional[Env]:
-    if isinstance(pattern, Hole):
-        return {} if isinstance(obj, Hole) else None
-    if isinstance(pattern, Int):
-        return {} if isinstance(obj, Int) and obj.value == pattern.value else None
-    if isinstance(pattern, Float):
-        raise MatchError("pattern matching is not supported for Floats")
-    if isinstance(pattern, String):
-        return {} if isinstance(obj, String) and obj.value == pattern.value else None
-    if isinstance(pattern, Var):
-        return {pattern.name: obj}
-    if isinstance(pattern, Variant):
-        if not isinstance(obj, Variant):
-            return None
-        if obj.tag != pattern.tag:
+# Returned by match for every successful match that binds nothing, so that
+# literal patterns do not allocate. Shared: never mutate a match result.
+EMPTY_ENV: Env = {}
+
+
+def match_hole(obj: Object, pattern: Object) -> Optional[Env]:
+    return EMPTY_ENV if type(obj) is Hole else None
+
+
+def match_int(obj: Object, pattern: Object) -> Optional[Env]:
+    assert isinstance(pattern, Int)
+    return EMPTY_ENV if type(obj) is Int and obj.value == pattern.value else None
+
+
+def match_float(obj: Object, pattern: Object) -> Optional[Env]:
+    raise MatchError("pattern matching is not supported for Floats")
+
+
+def match_string(obj: Object, pattern: Object) -> Optional[Env]:
+    assert isinstance(pattern, String)
+    return EMPTY_ENV if type(obj) is String and obj.value == pattern.value else None
+
+
+def match_var(obj: Object, pattern: Object) -> Optional[Env]:
+    assert isinstance(pattern, Var)
+    return {pattern.name: obj}
+
+
+def match_variant(obj: Object, pattern: Object) -> Optional[Env]:
+    assert isinstance(pattern, Variant)
+    if type(obj) is not Variant:
+        return None
+    if obj.tag != pattern.tag:
+        return None
+    return match(obj.value, pattern.value)
+
+
+def match_record(obj: Object, pattern: Object) -> Optional[Env]:
+    assert isinstance(pattern, Record)
+    if type(obj) is not Record:
+        return None
+    result: Env = EMPTY_ENV
+    use_spread = False
+    seen_keys: set[str] = set()
+    for key, pattern_item in pattern.data.items():
+        if isinstance(pattern_item, Spread):
+            use_spread = True
+            if pattern_item.name is not None:
+                if result is EMPTY_ENV:
+                    result = {}
+                assert isinstance(result, dict)  # for .update()
+                rest_keys = set(obj.data.keys()) - seen_keys
+                result.update({pattern_item.name: Record({key: obj.data[key] for key in rest_keys})})
+            break
+        seen_keys.add(key)
+        obj_item = obj.data.get(key)
+        if obj_item is None:
             return None
-        return match(obj.value, pattern.value)
-    if isinstance(pattern, Record):
-        if not isinstance(obj, Record):
+        part = match(obj_item, pattern_item)
+        if part is None:
             return None
-        result: Env = {}
-        use_spread = False
-        seen_keys: set[str] = set()
-        for key, pattern_item in pattern.data.items():
-            if isinstance(pattern_item, Spread):
-                use_spread = True
-                if pattern_item.name is not None:
-                    assert isinstance(result, dict)  # for .update()
-                    rest_keys = set(obj.data.keys()) - seen_keys
-                    result.update({pattern_item.name: Record({key: obj.data[key] for key in rest_keys})})
-                break
-            seen_keys.add(key)
-            obj_item = obj.data.get(key)
-            if obj_item is None:
-                return None
-            part = match(obj_item, pattern_item)
-            if part is None:
-                return None
+        if part:
+            if result is EMPTY_ENV:
+                result = {}
             assert isinstance(result, dict)  # for .update()
             result.update(part)
-        if not use_spread and len(pattern.data) != len(obj.data):
+    if not use_spread and len(pattern.data) != len(obj.data):
+        return None
+    return result
+
+
+def match_list(obj: Object, pattern: Object) -> Optional[Env]:
+    assert isinstance(pattern, List)
+    if type(obj) is not List:
+        return None
+    result: Env = EMPTY_ENV
+    use_spread = False
+    for i, pattern_item in enumerate(pattern.items):
+        if isinstance(pattern_item, Spread):
+            use_spread = True
+            if pattern_item.name is not None:
+                if result is EMPTY_ENV:
+                    result = {}
+                assert isinstance(result, dict)  # for .update()
+                result.update({pattern_item.name: List(obj.items[i:])})
+            break
+        if i >= len(obj.items):
             return None
-        return result
-    if isinstance(pattern, List):
-        if not isinstance(obj, List):
+        obj_item = obj.items[i]
+        part = match(obj_item, pattern_item)
+        if part is None:
             return None
-        result: Env = {}  # type: ignore
-        use_spread = False
-        for i, pattern_item in enumerate(pattern.items):
-            if isinstance(pattern_item, Spread):
-                use_spread = True
-                if pattern_item.name is not None:
-                    assert isinstance(result, dict)  # for .update()
-                    result.update({pattern_item.name: List(obj.items[i:])})
-                break
-            if i >= len(obj.items):
-                return None
-            obj_item = obj.items[i]
-            part = match(obj_item, pattern_item)
-            if part is None:
-                return None
+        if part:
+            if result is EMPTY_ENV:
+                result = {}
             assert isinstance(result, dict)  # for .update()
             result.update(part)
-        if not use_spread and len(pattern.items) != len(obj.items):
-            return None
-        return result
-    raise NotImplementedError(f"match not implemented for {type(pattern).__name__}")
+    if not use_spread and len(pattern.items) != len(obj.items):
+        return None
+    return result
+
+
+# How match handles each kind of pattern, so that it dispatches with one
+# lookup on the pattern's type instead of a chain of isinstance checks. No
+# node class is subclassed, so the matchers also reject a subject of the
+# wrong kind with an exact type() comparison.
+MATCHERS: Dict[type, Callable[[Object, Object], Optional[Env]]] = {
+    Hole: match_hole,
+    Int: match_int,
+    Float: match_float,
+    String: match_string,
+    Var: match_var,
+    Variant: match_variant,
+    Record: match_record,
+    List: match_list,
+}
+
+
+def match(obj: Object, pattern: Object) -> Optional[Env]:
+    matcher = MATCHERS.get(type(pattern))
+    if matcher is None:
+        raise NotImplementedError(f"match not implemented for {type(pattern).__name__}")
+    return matcher(obj, pattern)
+
+
+def match_key(obj: Object) -> Any:
+    # What a constant pattern of obj's type compares exactly: a subject
+    # matches a constant pattern if and only if they have the same type and
+    # the same key. None for objects that no constant pattern describes.
+    if isinstance(obj, (Int, String)):
+        return obj.value
+    if isinstance(obj, Variant) and isinstance(obj.value, Hole):
+        return obj.tag
+    return None
+
+
+# The cases of a MatchFunction, compiled for application: for constant
+# patterns, the index of the first case by pattern type and match_key, and
+# every other case with its index
+MatchTable = Tuple[Dict[type, Dict[Any, int]], typing.List[Tuple[int, MatchCase]]]
+
 
+# With only a few constant cases, trying every case in order is as fast as
+# building a key and looking it up
+MATCH_TABLE_MIN_CONSTANTS = 4
 
-def free_in(exp: Object) -> Set[str]:
+
+def build_match_table(cases: typing.List[MatchCase]) -> Optional[MatchTable]:
+    constants: Dict[type, Dict[Any, int]] = {}
+    others = []
+    for idx, case in enumerate(cases):
+        key = match_key(case.pattern)
+        if key is None:
+            others.append((idx, case))
+        else:
+            constants.setdefault(type(case.pattern), {}).setdefault(key, idx)
+    if len(cases) - len(others) < MATCH_TABLE_MIN_CONSTANTS:
+        return None
+    return constants, others
+
+
+def free_in(exp: Object) -> FrozenSet[str]:
     if isinstance(exp, (Int, Float, String, Bytes, Hole, NativeFunction)):
-        return set()
+        return frozenset()
     if isinstance(exp, Variant):
         return free_in(exp.value)
     if isinstance(exp, Var):
-        return {exp.name}
+        return frozenset((exp.name,))
     if isinstance(exp, Spread):
         if exp.name is not None:
-            return {exp.name}
-        return set()
+            return frozenset((exp.name,))
+        return frozenset()
     if isinstance(exp, Binop):
         return free_in(exp.left) | free_in(exp.right)
     if isinstance(exp, List):
-        if not exp.items:
-            return set()
-        return set.union(*(free_in(item) for item in exp.items))
+        return frozenset().union(*(free_in(item) for item in exp.items))
     if isinstance(exp, Record):
-        if not exp.data:
-            return set()
-        return set.union(*(free_in(value) for key, value in exp.data.items()))
+        return frozenset().union(*(free_in(value) for key, value in exp.data.items()))
     if isinstance(exp, Function):
-        assert isinstance(exp.arg, Var)
-        return free_in(exp.body) - {exp.arg.name}
+        # Closures re-run free_in on the same function every time they are
+        # created, so remember the answer on the node. It is a frozenset so
+        # that no caller can corrupt the cached value.
+        result = getattr(exp, "free_vars", None)
+        if result is None:
+            assert isinstance(exp.arg, Var)
+            result = free_in(exp.body) - {exp.arg.name}
+            object.__setattr__(exp, "free_vars", result)
+        return result
     if isinstance(exp, MatchFunction):
-        if not exp.cases:
-            return set()
-        return set.union(*(free_in(case) for case in exp.cases))
+        result = getattr(exp, "free_vars", None)
+        if result is None:
+            result = frozenset().union(*(free_in(case) for case in exp.cases))
+            object.__setattr__(exp, "free_vars", result)
+        return result
     if isinstance(exp, MatchCase):
         return free_in(exp.body) - free_in(exp.pattern)
     if isinstance(exp, Apply):
@@ -1503,105 +2164,221 @@ def improve_closure(closure: Closure) -> Closure:
     return Closure(env, closure.func)
 
 
-def eval_exp(env: Env, exp: Object) -> Object:
-    logger.debug(exp)
-    if isinstance(exp, (Int, Float, String, Bytes, Hole, Closure, NativeFunction)):
-        return exp
-    if isinstance(exp, Variant):
-        return Variant(exp.tag, eval_exp(env, exp.value))
-    if isinstance(exp, Var):
-        value = env.get(exp.name)
-        if value is None:
-            raise NameError(f"name '{exp.name}' is not defined")
-        return value
-    if isinstance(exp, Binop):
-        handler = BINOP_HANDLERS.get(exp.op)
-        if handler is None:
-            raise NotImplementedError(f"no handler for {exp.op}")
-        return handler(env, exp.left, exp.right)
-    if isinstance(exp, List):
-        return List([eval_exp(env, item) for item in exp.items])
-    if isinstance(exp, Record):
-        return Record({k: eval_exp(env, exp.data[k]) for k in exp.data})
-    if isinstance(exp, Assign):
-        # TODO(max): Rework this. There's something about matching that we need
-        # to figure out and implement.
-        assert isinstance(exp.name, Var)
-        value = eval_exp(env, exp.value)
-        if isinstance(value, Closure):
-            # We want functions to be able to call themselves without using the
-            # Y combinator or similar, so we bind functions (and only
-            # functions) using a letrec-like strategy. We augment their
-            # captured environment with a binding to themselves.
-            assert isinstance(value.env, dict)
-            value.env[exp.name.name] = value
-            # We still improve_closure here even though we also did it on
-            # Closure creation because the Closure might not need a binding for
-            # itself (it might not be recursive).
+def eval_literal(env: Env, exp: Object) -> Object:
+    return exp
+
+
+def eval_variant(env: Env, exp: Object) -> Object:
+    assert isinstance(exp, Variant)
+    return Variant(exp.tag, eval_exp(env, exp.value))
+
+
+def eval_var(env: Env, exp: Object) -> Object:
+    assert isinstance(exp, Var)
+    value = env.get(exp.name)
+    if value is None:
+        raise NameError(f"name '{exp.name}' is not defined")
+    return value
+
+
+def eval_binop(env: Env, exp: Object) -> Object:
+    assert isinstance(exp, Binop)
+    # Inline the most common operators to skip the handler lookup and the
+    # extra call frame; everything else goes through BINOP_HANDLERS
+    op = exp.op
+    if op is BinopKind.ADD:
+        left = eval_number(env, exp.left)
+        return wrap_inferred_number_type(left + eval_number(env, exp.right))
+    if op is BinopKind.SUB:
+        left = eval_number(env, exp.left)
+        return wrap_inferred_number_type(left - eval_number(env, exp.right))
+    if op is BinopKind.MUL:
+        left = eval_number(env, exp.left)
+        return wrap_inferred_number_type(left * eval_number(env, exp.right))
+    if op is BinopKind.LESS:
+        left = eval_number(env, exp.left)
+        return TRUE if left < eval_number(env, exp.right) else FALSE
+    if op is BinopKind.EQUAL:
+        left_obj = eval_exp(env, exp.left)
+        return TRUE if left_obj == eval_exp(env, exp.right) else FALSE
+    handler = BINOP_HANDLERS.get(op)
+    if handler is None:
+        raise NotImplementedError(f"no handler for {op}")
+    return handler(env, exp.left, exp.right)
+
+
+def eval_list_literal(env: Env, exp: Object) -> Object:
+    assert isinstance(exp, List)
+    return List([eval_exp(env, item) for item in exp.items])
+
+
+def eval_record_literal(env: Env, exp: Object) -> Object:
+    assert isinstance(exp, Record)
+    return Record({k: eval_exp(env, exp.data[k]) for k in exp.data})
+
+
+def eval_assign(env: Env, exp: Object) -> Object:
+    assert isinstance(exp, Assign)
+    # TODO(max): Rework this. There's something about matching that we need
+    # to figure out and implement.
+    assert isinstance(exp.name, Var)
+    value = eval_exp(env, exp.value)
+    if isinstance(value, Closure):
+        # We want functions to be able to call themselves without using the
+        # Y combinator or similar, so we bind functions (and only
+        # functions) using a letrec-like strategy. We augment their
+        # captured environment with a binding to themselves.
+        assert isinstance(value.env, dict)
+        value.env[exp.name.name] = value
+        # We still improve_closure here even though we also did it on
+        # Closure creation because the Closure might not need a binding for
+        # itself (it might not be recursive). Recursive closures already
+        # own a minimal env, so skip rebuilding it for them.
+        if not value.env.keys() <= free_in(value.func):
             value = improve_closure(value)
-        return EnvObject({**env, exp.name.name: value})
-    if isinstance(exp, Where):
-        assert isinstance(exp.binding, Assign)
-        res_env = eval_exp(env, exp.binding)
-        assert isinstance(res_env, EnvObject)
-        new_env = {**env, **res_env.env}
-        return eval_exp(new_env, exp.body)
-    if isinstance(exp, Assert):
-        cond = eval_exp(env, exp.cond)
-        if cond != TRUE:
-            raise AssertionError(f"condition {exp.cond} failed")
-        return eval_exp(env, exp.value)
-    if isinstance(exp, Function):
-        if not isinstance(exp.arg, Var):
-            raise RuntimeError(f"expected variable in function definition {exp.arg}")
-        value = Closure(env, exp)
-        value = improve_closure(value)
-        return value
-    if isinstance(exp, MatchFunction):
-        value = Closure(env, exp)
-        value = improve_closure(value)
-        return value
-    if isinstance(exp, Apply):
-        if isinstance(exp.func, Var) and exp.func.name == "$$quote":
-            return exp.arg
-        callee = eval_exp(env, exp.func)
-        arg = eval_exp(env, exp.arg)
-        if isinstance(callee, NativeFunction):
-            return callee.func(arg)
-        if not isinstance(callee, Closure):
-            raise TypeError(f"attempted to apply a non-closure of type {type(callee).__name__}")
-        if isinstance(callee.func, Function):
-            assert isinstance(callee.func.arg, Var)
-            new_env = {**callee.env, callee.func.arg.name: arg}
-            return eval_exp(new_env, callee.func.body)
-        elif isinstance(callee.func, MatchFunction):
-            for case in callee.func.cases:
-                m = match(arg, case.pattern)
-                if m is None:
-                    continue
-                return eval_exp({**callee.env, **m}, case.body)
-            raise MatchError("no matching cases")
-        else:
-            raise TypeError(f"attempted to apply a non-function of type {type(callee.func).__name__}")
-    if isinstance(exp, Access):
-        obj = eval_exp(env, exp.obj)
-        if isinstance(obj, Record):
-            if not isinstance(exp.at, Var):
-                raise TypeError(f"cannot access record field using {type(exp.at).__name__}, expected a field name")
-            if exp.at.name not in obj.data:
-                raise NameError(f"no assignment to {exp.at.name} found in record")
-            return obj.data[exp.at.name]
-        elif isinstance(obj, List):
-            access_at = eval_exp(env, exp.at)
-            if not isinstance(access_at, Int):
-                raise TypeError(f"cannot index into list using type {type(access_at).__name__}, expected integer")
-            if access_at.value < 0 or access_at.value >= len(obj.items):
-                raise ValueError(f"index {access_at.value} out of bounds for list")
-            return obj.items[access_at.value]
-        raise TypeError(f"attempted to access from type {type(obj).__name__}")
-    elif isinstance(exp, Spread):
-        raise RuntimeError("cannot evaluate a spread")
-    raise NotImplementedError(f"eval_exp not implemented for {exp}")
+    return EnvObject({**env, exp.name.name: value})
+
+
+def eval_function(env: Env, exp: Object) -> Object:
+    assert isinstance(exp, Function)
+    if not isinstance(exp.arg, Var):
+        raise RuntimeError(f"expected variable in function definition {exp.arg}")
+    value = Closure(env, exp)
+    value = improve_closure(value)
+    return value
+
+
+def eval_match_function(env: Env, exp: Object) -> Object:
+    assert isinstance(exp, MatchFunction)
+    value = Closure(env, exp)
+    value = improve_closure(value)
+    return value
+
+
+def eval_apply(env: Env, exp: Object) -> Object:
+    assert isinstance(exp, Apply)
+    if isinstance(exp.func, Var) and exp.func.name == "$$quote":
+        return exp.arg
+    callee = eval_exp(env, exp.func)
+    arg = eval_exp(env, exp.arg)
+    if isinstance(callee, NativeFunction):
+        return callee.func(arg)
+    if not isinstance(callee, Closure):
+        raise TypeError(f"attempted to apply a non-closure of type {type(callee).__name__}")
+    if isinstance(callee.func, Function):
+        assert isinstance(callee.func.arg, Var)
+        new_env = {**callee.env, callee.func.arg.name: arg}
+        return eval_exp(new_env, callee.func.body)
+    elif isinstance(callee.func, MatchFunction):
+        if callee.func.match_table is not None:
+            return apply_match_table(callee, arg)
+        for case in callee.func.cases:
+            m = match(arg, case.pattern)
+            if m is None:
+                continue
+            return eval_exp({**callee.env, **m}, case.body)
+        raise MatchError("no matching cases")
+    else:
+        raise TypeError(f"attempted to apply a non-function of type {type(callee.func).__name__}")
+
+
+def apply_match_table(callee: Closure, arg: Object) -> Object:
+    assert isinstance(callee.func, MatchFunction)
+    cases = callee.func.cases
+    assert callee.func.match_table is not None
+    constants, others = callee.func.match_table
+    # Find the first constant case for arg with one lookup, then only try the
+    # non-constant cases that come before it
+    first = len(cases)
+    by_key = constants.get(type(arg))
+    if by_key is not None:
+        first = by_key.get(match_key(arg), first)
+    for idx, case in others:
+        if idx > first:
+            break
+        m = match(arg, case.pattern)
+        if m is None:
+            continue
+        return eval_exp({**callee.env, **m}, case.body)
+    if first < len(cases):
+        return eval_exp(callee.env, cases[first].body)
+    raise MatchError("no matching cases")
+
+
+def eval_access(env: Env, exp: Object) -> Object:
+    assert isinstance(exp, Access)
+    obj = eval_exp(env, exp.obj)
+    if isinstance(obj, Record):
+        if not isinstance(exp.at, Var):
+            raise TypeError(f"cannot access record field using {type(exp.at).__name__}, expected a field name")
+        if exp.at.name not in obj.data:
+            raise NameError(f"no assignment to {exp.at.name} found in record")
+        return obj.data[exp.at.name]
+    elif isinstance(obj, List):
+        access_at = eval_exp(env, exp.at)
+        if not isinstance(access_at, Int):
+            raise TypeError(f"cannot index into list using type {type(access_at).__name__}, expected integer")
+        if access_at.value < 0 or access_at.value >= len(obj.items):
+            raise ValueError(f"index {access_at.value} out of bounds for list")
+        return obj.items[access_at.value]
+    raise TypeError(f"attempted to access from type {type(obj).__name__}")
+
+
+def eval_spread(env: Env, exp: Object) -> Object:
+    raise RuntimeError("cannot evaluate a spread")
+
+
+# How eval_exp handles each kind of expression, so that it dispatches with
+# one lookup on the expression's type instead of a chain of isinstance checks.
+# Where and Assert are missing on purpose: eval_exp loops on their tail
+# expressions itself.
+EVALUATORS: Dict[type, Callable[[Env, Object], Object]] = {
+    Int: eval_literal,
+    Float: eval_literal,
+    String: eval_literal,
+    Bytes: eval_literal,
+    Hole: eval_literal,
+    Closure: eval_literal,
+    NativeFunction: eval_literal,
+    Variant: eval_variant,
+    Var: eval_var,
+    Binop: eval_binop,
+    List: eval_list_literal,
+    Record: eval_record_literal,
+    Assign: eval_assign,
+    Function: eval_function,
+    MatchFunction: eval_match_function,
+    Apply: eval_apply,
+    Access: eval_access,
+    Spread: eval_spread,
+}
+
+
+def eval_exp(env: Env, exp: Object) -> Object:
+    # Expressions in tail position (the body of a Where, the value of an
+    # Assert) are evaluated by going around this loop instead of recursing,
+    # so long chains of them do not grow the stack
+    while True:
+        logger.debug(exp)
+        evaluator = EVALUATORS.get(type(exp))
+        if evaluator is not None:
+            return evaluator(env, exp)
+        if isinstance(exp, Where):
+            assert isinstance(exp.binding, Assign)
+            res_env = eval_assign(env, exp.binding)
+            assert isinstance(res_env, EnvObject)
+            # Evaluating an Assign already yields a fresh copy of env extended
+            # with the new binding, so there is no need to merge env in again
+            env = res_env.env
+            exp = exp.body
+            continue
+        if isinstance(exp, Assert):
+            cond = eval_exp(env, exp.cond)
+            if cond != TRUE:
+                raise AssertionError(f"condition {exp.cond} failed")
+            exp = exp.value
+            continue
+        raise NotImplementedError(f"eval_exp not implemented for {exp}")
 
 
 class ScrapMonad:
@@ -1676,6 +2453,21 @@ class TokenizerTests(unittest.TestCase):
     def test_tokenize_dollar_dollar_var(self) -> None:
         self.assertEqual(list(tokenize("$$bills")), [Name("$$bills")])
 
+    def test_tokenize_ascii_matches_lexer(self) -> None:
+        source = 'f = a -> "x\ny" ++ a -- c\n  . a = [1.5, ~~16\'41, #t ()]\n{ x = ...r }'
+        lexer = Lexer(source)
+        expected = []
+        while not isinstance(token := lexer.read_token(), EOF):
+            expected.append(token)
+        actual = tokenize_ascii(source)
+        assert actual is not None
+        self.assertEqual(actual, expected)
+        self.assertEqual([t.location for t in actual], [t.location for t in expected])
+
+    def test_tokenize_repeated_var_shares_name_string(self) -> None:
+        a, _, b = tokenize("abc + abc")
+        self.assertIs(a.value, b.value)
+
     def test_tokenize_dot_dot_raises_parse_error(self) -> None:
         with self.assertRaisesRegex(ParseError, re.escape("unexpected token '..'")):
             list(tokenize(".."))
@@ -1755,22 +2547,28 @@ class TokenizerTests(unittest.TestCase):
             list(tokenize("~="))
 
     def test_tokenize_tilde_tilde_returns_empty_bytes(self) -> None:
-        self.assertEqual(list(tokenize("~~")), [BytesLit("", 64)])
+        self.assertEqual(list(tokenize("~~")), [BytesLit(b"", 64)])
 
     def test_tokenize_bytes_returns_bytes_base64(self) -> None:
-        self.assertEqual(list(tokenize("~~QUJD")), [BytesLit("QUJD", 64)])
+        self.assertEqual(list(tokenize("~~QUJD")), [BytesLit(b"QUJD", 64)])
 
     def test_tokenize_bytes_base85(self) -> None:
-        self.assertEqual(list(tokenize("~~85'K|(_")), [BytesLit("K|(_", 85)])
+        self.assertEqual(list(tokenize("~~85'K|(_")), [BytesLit(b"K|(_", 85)])
 
     def test_tokenize_bytes_base64(self) -> None:
-        self.assertEqual(list(tokenize("~~64'QUJD")), [BytesLit("QUJD", 64)])
+        self.assertEqual(list(tokenize("~~64'QUJD")), [BytesLit(b"QUJD", 64)])
 
     def test_tokenize_bytes_base32(self) -> None:
-        self.assertEqual(list(tokenize("~~32'IFBEG===")), [BytesLit("IFBEG===", 32)])
+        self.assertEqual(list(tokenize("~~32'IFBEG===")), [BytesLit(b"IFBEG===", 32)])
 
     def test_tokenize_bytes_base16(self) -> None:
-        self.assertEqual(list(tokenize("~~16'414243")), [BytesLit("414243", 16)])
+        self.assertEqual(list(tokenize("~~16'414243")), [BytesLit(b"414243", 16)])
+
+    def test_tokenize_bytes_with_non_ascii_raises_invalid_token_error(self) -> None:
+        with self.assertRaises(InvalidTokenError) as ctx:
+            list(tokenize("1 ~~QUJD\u00e9"))
+        extent = ctx.exception.unexpected_token
+        self.assertEqual((extent.start.colno, extent.end.colno), (3, 9))
 
     def test_tokenize_hole(self) -> None:
         self.assertEqual(list(tokenize("()")), [LeftParen(), RightParen()])
@@ -2017,6 +2815,22 @@ class TokenizerTests(unittest.TestCase):
         self.assertEqual(a.source_extent.start.byteno, 0)
         self.assertEqual(a.source_extent.end.byteno, 25)
 
+    def test_read_token_correctly_sets_source_extents_after_multiline_string_and_comment(self) -> None:
+        l = Lexer('"a\nbc" -- é\n  d')
+        a = l.read_token()
+        b = l.read_token()
+
+        self.assertEqual(a.source_extent.start.lineno, 1)
+        self.assertEqual(a.source_extent.end.lineno, 2)
+        self.assertEqual(a.source_extent.start.colno, 1)
+        self.assertEqual(a.source_extent.end.colno, 3)
+        self.assertEqual(a.source_extent.end.byteno, 5)
+
+        self.assertEqual(b.source_extent.start.lineno, 3)
+        self.assertEqual(b.source_extent.start.colno, 3)
+        self.assertEqual(b.source_extent.start.byteno, 15)
+        self.assertEqual(l.line, "  d")
+
     def test_read_token_correctly_sets_source_extents_for_byte_literals(self) -> None:
         l = Lexer("~~QUJD ~~85'K|(_ ~~64'QUJD\n ~~32'IFBEG=== ~~16'414243")
         a = l.read_token()
@@ -2231,6 +3045,12 @@ class ParserTests(unittest.TestCase):
     def test_parse_negative_float_returns_binary_sub_float(self) -> None:
         self.assertEqual(parse(Peekable(iter([Operator("-"), FloatLit(3.14)]))), Float(-3.14))
 
+    def test_parse_shares_small_int_nodes_but_not_vars(self) -> None:
+        exp = parse(tokenize("[1, x, 1, x]"))
+        assert isinstance(exp, List)
+        self.assertIs(exp.items[0], exp.items[2])
+        self.assertIsNot(exp.items[1], exp.items[3])
+
     def test_parse_var_returns_var(self) -> None:
         self.assertEqual(parse(Peekable(iter([Name("abc_123")]))), Var("abc_123"))
 
@@ -2255,7 +3075,7 @@ class ParserTests(unittest.TestCase):
         self.assertEqual(parse(Peekable(iter([Name("$$bills")]))), Var("$$bills"))
 
     def test_parse_bytes_returns_bytes(self) -> None:
-        self.assertEqual(parse(Peekable(iter([BytesLit("QUJD", 64)]))), Bytes(b"ABC"))
+        self.assertEqual(parse(Peekable(iter([BytesLit(b"QUJD", 64)]))), Bytes(b"ABC"))
 
     def test_parse_binary_add_returns_binop(self) -> None:
         self.assertEqual(
@@ -2775,6 +3595,27 @@ class MatchTests(unittest.TestCase):
     def test_match_hole_with_hole_returns_empty_dict(self) -> None:
         self.assertEqual(match(Hole(), pattern=Hole()), {})
 
+    def test_match_literal_shares_empty_env(self) -> None:
+        self.assertIs(match(Int(1), pattern=Int(1)), EMPTY_ENV)
+        self.assertIs(match(List([Int(1)]), pattern=List([Int(1)])), EMPTY_ENV)
+
+    def test_match_table_splits_constant_cases(self) -> None:
+        exp = parse(tokenize('| 1 -> a | x -> b | "s" -> c | #t () -> d | 1 -> e'))
+        assert isinstance(exp, MatchFunction)
+        assert exp.match_table is not None  # For mypy
+        constants, others = exp.match_table
+        self.assertEqual(constants, {Int: {1: 0}, String: {"s": 2}, Variant: {"t": 3}})
+        self.assertEqual(others, [(1, exp.cases[1])])
+
+    def test_match_table_skips_match_functions_with_few_constant_cases(self) -> None:
+        exp = parse(tokenize("| 0 -> 0 | 1 -> 1 | n -> n"))
+        assert isinstance(exp, MatchFunction)
+        self.assertIsNone(exp.match_table)
+
+    def test_match_with_unsupported_pattern_raises_not_implemented_error(self) -> None:
+        with self.assertRaisesRegex(NotImplementedError, "match not implemented for Apply"):
+            match(Int(1), pattern=Apply(Var("f"), Var("x")))
+
     def test_match_with_equal_ints_returns_empty_dict(self) -> None:
         self.assertEqual(match(Int(1), pattern=Int(1)), {})
 
@@ -3058,6 +3899,10 @@ class EvalTests(unittest.TestCase):
         exp = Int(5)
         self.assertEqual(eval_exp({}, exp), Int(5))
 
+    def test_eval_unsupported_expression_raises_not_implemented_error(self) -> None:
+        with self.assertRaisesRegex(NotImplementedError, "eval_exp not implemented for"):
+            eval_exp({}, EnvObject({}))
+
     def test_eval_float_returns_float(self) -> None:
         exp = Float(3.14)
         self.assertEqual(eval_exp({}, exp), Float(3.14))
@@ -3085,6 +3930,11 @@ class EvalTests(unittest.TestCase):
         exp = Binop(BinopKind.ADD, Int(1), Int(2))
         self.assertEqual(eval_exp({}, exp), Int(3))
 
+    def test_eval_with_binop_shares_small_int_results(self) -> None:
+        self.assertIs(eval_exp({}, Binop(BinopKind.SUB, Int(1), Int(3))), int_node(-2))
+        self.assertIs(eval_exp({}, Binop(BinopKind.MUL, Int(32), Int(32))), int_node(1024))
+        self.assertEqual(eval_exp({}, Binop(BinopKind.ADD, Int(1024), Int(1))), Int(1025))
+
     def test_eval_with_nested_binop(self) -> None:
         exp = Binop(BinopKind.ADD, Binop(BinopKind.ADD, Int(1), Int(2)), Int(3))
         self.assertEqual(eval_exp({}, exp), Int(6))
@@ -3245,6 +4095,12 @@ class EvalTests(unittest.TestCase):
         exp = Assert(Assert(Int(123), TRUE), TRUE)
         self.assertEqual(eval_exp({}, exp), Int(123))
 
+    def test_eval_deeply_nested_where_does_not_recurse(self) -> None:
+        exp: Object = Var("x0")
+        for i in range(sys.getrecursionlimit() * 2):
+            exp = Where(exp, Assign(Var(f"x{i}"), Int(i)))
+        self.assertEqual(eval_exp({}, exp), Int(0))
+
     def test_eval_hole(self) -> None:
         exp = Hole()
         self.assertEqual(eval_exp({}, exp), Hole())
@@ -3672,6 +4528,68 @@ class EndToEndTests(EndToEndTestsBase):
             Int(3),
         )
 
+    def test_match_constant_case_after_var_case_does_not_take_precedence(self) -> None:
+        self.assertEqual(
+            self._run(
+                """
+                f 1
+                . f =
+                  | 0 -> 10
+                  | 2 -> 12
+                  | 3 -> 13
+                  | x -> 20
+                  | 1 -> 30
+                """
+            ),
+            Int(20),
+        )
+
+    def test_match_first_of_duplicate_constant_cases_wins(self) -> None:
+        self.assertEqual(
+            self._run(
+                """
+                f #b ()
+                . f =
+                  | #a () -> 1
+                  | #b () -> 2
+                  | #c () -> 3
+                  | #b () -> 4
+                """
+            ),
+            Int(2),
+        )
+
+    def test_match_variant_with_payload_skips_constant_cases(self) -> None:
+        self.assertEqual(
+            self._run(
+                """
+                f (#a 5)
+                . f =
+                  | #a () -> 1
+                  | #b () -> 2
+                  | #c () -> 3
+                  | #d () -> 4
+                  | #a x -> x
+                """
+            ),
+            Int(5),
+        )
+
+    def test_match_constant_case_does_not_match_other_type(self) -> None:
+        self.assertEqual(
+            self._run(
+                """
+                f "1"
+                . f =
+                  | 1 -> 1
+                  | 2 -> 2
+                  | 3 -> 3
+                  | "1" -> 4
+                """
+            ),
+            Int(4),
+        )
+
     def test_match_function_can_close_over_variables(self) -> None:
         self.assertEqual(
             self._run(
@@ -3850,6 +4768,17 @@ class EndToEndTests(EndToEndTestsBase):
         )
         self.assertEqual(result, Closure({"f": result}, Function(Var("n"), Var("f"))))
 
+    def test_recursive_function_binds_itself(self) -> None:
+        result = self._run(
+            """
+    f 1
+    . f = n -> f
+    """,
+            {},
+        )
+        assert isinstance(result, Closure)  # For mypy
+        self.assertIs(result.env["f"], result)
+
     def test_function_can_call_itself(self) -> None:
         with self.assertRaises(RecursionError):
             self._run(
@@ -4021,6 +4950,11 @@ class ClosureOptimizeTests(unittest.TestCase):
         exp = parse(tokenize("x -> x + y"))
         self.assertEqual(free_in(exp), {"y"})
 
+    def test_function_caches_free_vars(self) -> None:
+        exp = parse(tokenize("x -> x + y"))
+        self.assertIs(free_in(exp), free_in(exp))
+        self.assertIsInstance(free_in(exp), frozenset)
+
     def test_nested_function(self) -> None:
         exp = parse(tokenize("x -> y -> x + y + z"))
         self.assertEqual(free_in(exp), {"z"})
@@ -5409,17 +6343,29 @@ class SerializerTests(unittest.TestCase):
 
     def test_empty_list(self) -> None:
         obj = List([])
-        self.assertEqual(self._serialize(obj), ref(TYPE_LIST) + b"\x00")
+        self.assertEqual(self._serialize(obj), TYPE_LIST + b"\x00")
 
     def test_list(self) -> None:
         obj = List([Int(123), Int(456)])
-        self.assertEqual(self._serialize(obj), ref(TYPE_LIST) + b"\x04i\xf6\x01i\x90\x07")
+        self.assertEqual(self._serialize(obj), TYPE_LIST + b"\x04i\xf6\x01i\x90\x07")
 
     def test_self_referential_list(self) -> None:
         obj = List([])
         obj.items.append(obj)
         self.assertEqual(self._serialize(obj), ref(TYPE_LIST) + b"\x02r\x00")
 
+    def test_float_list_is_packed(self) -> None:
+        obj = List([Float(1.0), Float(-2.5)])
+        self.assertEqual(
+            self._serialize(obj),
+            TYPE_FLOAT_LIST + b"\x04\x00\x00\x00\x00\x00\x00\xf0?\x00\x00\x00\x00\x00\x00\x04\xc0",
+        )
+
+    def test_shared_list_is_written_once(self) -> None:
+        inner = List([])
+        obj = List([inner, inner])
+        self.assertEqual(self._serialize(obj), TYPE_LIST + b"\x04" + ref(TYPE_LIST) + b"\x00r\x00")
+
     def test_variant(self) -> None:
         obj = Variant("abc", Int(123))
         self.assertEqual(self._serialize(obj), TYPE_VARIANT + b"\x06abci\xf6\x01")
@@ -5442,11 +6388,11 @@ class SerializerTests(unittest.TestCase):
 
     def test_match_function(self) -> None:
         obj = MatchFunction([MatchCase(Int(1), Var("x")), MatchCase(List([Int(1)]), Var("y"))])
-        self.assertEqual(self._serialize(obj), TYPE_MATCH_FUNCTION + b"\x04i\x02v\x02x\xdb\x02i\x02v\x02y")
+        self.assertEqual(self._serialize(obj), TYPE_MATCH_FUNCTION + b"\x04i\x02v\x02x[\x02i\x02v\x02y")
 
     def test_closure(self) -> None:
         obj = Closure({}, Function(Var("x"), Var("x")))
-        self.assertEqual(self._serialize(obj), ref(TYPE_CLOSURE) + b"fv\x02xv\x02x\x00")
+        self.assertEqual(self._serialize(obj), TYPE_CLOSURE + b"fv\x02xv\x02x\x00")
 
     def test_self_referential_closure(self) -> None:
         obj = Closure({}, Function(Var("x"), Var("x")))
@@ -5528,6 +6474,23 @@ class RoundTripSerializationTests(unittest.TestCase):
         self._rt(List([]))
         self._rt(List([Int(123), Int(345)]))
 
+    def test_float_list(self) -> None:
+        self._rt(List([Float(1.0), Float(-2.5), Float(3.14)]))
+
+    def test_shared_float_list(self) -> None:
+        inner = List([Float(1.0)])
+        result = self._serde(List([inner, inner]))
+        assert isinstance(result, List)  # For mypy
+        self.assertEqual(result, List([inner, inner]))
+        self.assertIs(result.items[0], result.items[1])
+
+    def test_shared_list(self) -> None:
+        inner = List([Int(1)])
+        result = self._serde(List([inner, inner]))
+        assert isinstance(result, List)  # For mypy
+        self.assertEqual(result, List([inner, inner]))
+        self.assertIs(result.items[0], result.items[1])
+
     def test_self_referential_list(self) -> None:
         ls = List([])
         ls.items.append(ls)
@@ -5574,6 +6537,43 @@ class RoundTripSerializationTests(unittest.TestCase):
     def test_bytes(self) -> None:
         self._rt(Bytes(b"abc"))
 
+    def test_deserialize_shares_hole_and_small_int_nodes(self) -> None:
+        result = self._serde(List([Hole(), Int(1)]))
+        assert isinstance(result, List)  # For mypy
+        self.assertIs(result.items[0], HOLE)
+        self.assertIs(result.items[1], int_node(1))
+
+    def test_deserialize_interns_record_keys(self) -> None:
+        key = "".join(["lo", "ng_key"])
+        result = self._serde(List([Record({key: Int(1)}), Record({key: Int(2)})]))
+        assert isinstance(result, List)  # For mypy
+        first, second = result.items
+        assert isinstance(first, Record)  # For mypy
+        assert isinstance(second, Record)  # For mypy
+        self.assertIs(next(iter(first.data)), next(iter(second.data)))
+
+    def test_deserialize_interns_short_strings_and_tags(self) -> None:
+        text = "".join(["hel", "lo"])
+        tag = "".join(["so", "me"])
+        result = self._serde(List([String(text), Variant(tag, Hole())]))
+        assert isinstance(result, List)  # For mypy
+        string, variant = result.items
+        assert isinstance(string, String)  # For mypy
+        assert isinstance(variant, Variant)  # For mypy
+        self.assertIs(string.value, sys.intern(text))
+        self.assertIs(variant.tag, sys.intern(tag))
+
+    def test_unknown_tag_raises_not_implemented_error(self) -> None:
+        with self.assertRaisesRegex(NotImplementedError, "Z"):
+            self._deserialize(b"Z")
+
+    def test_bytes_shares_flat_buffer(self) -> None:
+        flat = self._serialize(Bytes(b"abc"))
+        result = self._deserialize(flat)
+        assert isinstance(result, Bytes)  # For mypy
+        self.assertIsInstance(result.value, memoryview)
+        self.assertIs(result.value.obj, flat)  # type: ignore[attr-defined]
+
     def test_float(self) -> None:
         self._rt(Float(3.14))
 
@@ -6148,7 +7148,7 @@ OP_ENV = {
 def compile_command(args: argparse.Namespace) -> None:
     if args.run:
         args.compile = True
-    from compiler import compile_to_string
+    from compiler import compile_to_file
 
     with open(args.file, "r") as f:
         source = f.read()
@@ -6156,14 +7156,22 @@ def compile_command(args: argparse.Namespace) -> None:
     program = parse(tokenize(source))
     if args.check:
         infer_type(program, OP_ENV)
-    c_program = compile_to_string(program, args.debug)
 
     with open(args.platform, "r") as f:
         platform = f.read()
 
-    with open(args.output, "w") as f:
-        f.write(c_program)
-        f.write(platform)
+    # Stream into a temporary file next to the output and only move it into
+    # place once compilation succeeds, so a failed compile keeps the old output
+    tmp_output = f"{args.output}.tmp"
+    f = open(tmp_output, "w")
+    try:
+        with f:
+            compile_to_file(program, args.debug, f)
+            f.write(platform)
+    except BaseException:
+        os.unlink(tmp_output)
+        raise
+    os.replace(tmp_output, args.output)
 
     if args.format:
         import subprocess